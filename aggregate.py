@@ -0,0 +1,258 @@
+import csv
+import numpy as np
+
+# ==========================================
+#           RAGGED SESSION STACKS
+# ==========================================
+
+def pad_ragged(arrays, length=None, dtype=np.float64):
+    """
+    Stacks 1D arrays of different lengths into one NaN padded 2D array
+
+    Args:
+      arrays: list of 1D arrays, one per session
+      length: number of columns, defaults to the longest array
+      dtype: dtype of the result
+    Returns:
+      array of shape (len(arrays), length), NaN where a session has no data
+    """
+    if length is None:
+        length = max((len(a) for a in arrays), default=0)
+    stack = np.full((len(arrays), length), np.nan, dtype=dtype)
+    for row, a in zip(stack, arrays):
+        n = min(len(a), length)
+        row[:n] = a[:n]
+    return stack
+
+def moving_average(x, window, axis=-1):
+    """
+    Moving average from cumulative sums, O(n) in the length of `x` for any `window`.
+
+    NaN values are skipped: each output is the mean of the non-NaN values in its window,
+    NaN if the window has none. Same output length as `np.convolve(..., mode='valid')`.
+
+    Args:
+      x: array to smooth
+      window: number of samples averaged
+      axis: axis to smooth along
+    Returns:
+      array with `x.shape[axis] - window + 1` entries along `axis`
+    """
+    x = np.moveaxis(np.asarray(x, dtype=np.float64), axis, -1)
+    valid = ~np.isnan(x)
+    pad = [(0, 0)] * (x.ndim - 1) + [(1, 0)]
+    sums = np.pad(np.cumsum(np.where(valid, x, 0.0), axis=-1), pad)
+    counts = np.pad(np.cumsum(valid, axis=-1), pad)
+    window_sums = sums[..., window:] - sums[..., :-window]
+    window_counts = counts[..., window:] - counts[..., :-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = window_sums / window_counts
+    return np.moveaxis(result, -1, axis)
+
+def convergence_time(values, target, tolerance):
+    """
+    Returns the first frame after which `values` stays within `tolerance` of `target`,
+    for every session. NaN for sessions that never settle.
+
+    Args:
+      values: array of shape (n_sessions, n_frames), NaN padded sessions never settle
+        on their padding
+      target: value to converge to, a scalar or one value per session
+      tolerance: relative tolerance, scaled by max(1, |target|)
+    """
+    target = np.asarray(target, dtype=np.float64)
+    if target.ndim:
+        target = target[:, None]
+    with np.errstate(invalid="ignore"):
+        outside = ~(np.abs(values - target) <= tolerance * np.maximum(1.0, np.abs(target)))
+    # trailing NaN padding counts as settled, not as outside
+    n_valid = np.sum(~np.isnan(values), axis=1)
+    outside &= np.arange(values.shape[1]) < n_valid[:, None]
+    n_frames = values.shape[1]
+    # index of the last frame outside of the tolerance band
+    last_outside = n_frames - 1 - np.argmax(outside[:, ::-1], axis=1)
+    times = np.where(outside.any(axis=1), last_outside + 1, 0).astype(np.float64)
+    times[times >= n_valid] = np.nan
+    return times
+
+# ==========================================
+#          STREAMING QUANTILES
+# ==========================================
+
+class StreamingQuantiles:
+    """
+    Per time step quantiles over an unbounded number of sessions in bounded memory.
+
+    Keeps a fixed-range histogram for every time step, so memory is
+    O(n_time_steps * bins) no matter how many sessions are added. Quantiles are
+    interpolated inside a bin, accurate to about (high - low) / bins. Values outside
+    [low, high] are counted in the first or last bin.
+    """
+    def __init__(self, low, high, bins=512):
+        """
+        Args:
+          low, high: range of the histogram
+          bins: number of histogram bins
+        """
+        self.low = float(low)
+        self.high = float(high)
+        self.bins = bins
+        self.width = (self.high - self.low) / bins
+        self.counts = np.zeros((0, bins), dtype=np.int64)
+
+    def update(self, stack):
+        """
+        Adds a chunk of sessions
+
+        Args:
+          stack: array of shape (n_sessions, n_time_steps), NaN for missing values
+        """
+        n_steps = stack.shape[1]
+        if n_steps > len(self.counts):
+            grown = np.zeros((n_steps, self.bins), dtype=np.int64)
+            grown[:len(self.counts)] = self.counts
+            self.counts = grown
+
+        valid = ~np.isnan(stack)
+        index = np.floor((np.where(valid, stack, self.low) - self.low) / self.width)
+        index = np.clip(index, 0, self.bins - 1).astype(np.int64)
+        flat = (np.arange(n_steps) * self.bins + index)[valid]
+        self.counts[:n_steps] += np.bincount(flat, minlength=n_steps * self.bins).reshape(n_steps, self.bins)
+
+    def count(self):
+        """
+        Returns the number of sessions with data at every time step
+        """
+        return self.counts.sum(axis=1)
+
+    def quantile(self, q):
+        """
+        Returns the `q` quantile (0 <= q <= 1) at every time step, NaN where there is no data
+        """
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        target = q * total
+        # first bin whose cumulative count reaches the target
+        b = np.argmax(cumulative >= target[:, None], axis=1)
+        rows = np.arange(len(b))
+        below = np.where(b > 0, cumulative[rows, b - 1], 0)
+        in_bin = self.counts[rows, b]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.where(in_bin > 0, (target - below) / in_bin, 0.0)
+        result = self.low + (b + np.clip(fraction, 0.0, 1.0)) * self.width
+        return np.where(total > 0, result, np.nan)
+
+# ==========================================
+#             LEARNING CURVES
+# ==========================================
+
+def learning_curves(chunks, keys, window=100, quantiles=(0.1, 0.5, 0.9), streaming=None):
+    """
+    Quantile bands over sessions of different lengths, smoothed with `moving_average`.
+
+    Sessions are NaN padded instead of trimmed, so a short aborted session only drops out
+    of the frames it does not have.
+
+    Args:
+      chunks: iterable of lists of sessions, each session a dict of 1D arrays such as the
+        output of `SessionLoader.iter_load`. Read once
+      keys: arrays of every session to aggregate, e.g. ("machine_scores",)
+      window: moving average window in frames
+      quantiles: quantiles to compute
+      streaming: None to compute exact quantiles, or a dict mapping each key to a
+        (low, high) range to use `StreamingQuantiles` with bounded memory
+    Returns:
+      dict mapping each key to a dict with a smoothed curve per quantile (e.g. "q50") and
+      "count", the number of sessions with data at every frame
+    """
+    if streaming is None:
+        sessions = [session for chunk in chunks for session in chunk]
+        stacks = {key: pad_ragged([s[key] for s in sessions]) for key in keys}
+        raw = {}
+        for key, stack in stacks.items():
+            curves = np.nanquantile(stack, quantiles, axis=0) if stack.size else np.zeros((len(quantiles), 0))
+            raw[key] = (curves, np.sum(~np.isnan(stack), axis=0))
+    else:
+        estimators = {key: StreamingQuantiles(*streaming[key]) for key in keys}
+        for chunk in chunks:
+            for key, estimator in estimators.items():
+                estimator.update(pad_ragged([s[key] for s in chunk]))
+        raw = {key: (np.array([e.quantile(q) for q in quantiles]), e.count())
+               for key, e in estimators.items()}
+
+    result = {}
+    for key, (curves, count) in raw.items():
+        if curves.shape[1] > window:
+            curves = moving_average(curves, window, axis=1)
+        result[key] = {f"q{round(q * 100):02d}": curve for q, curve in zip(quantiles, curves)}
+        result[key]["count"] = count
+    return result
+
+# ==========================================
+#              ACTION DENSITY
+# ==========================================
+
+def action_density(chunks, bins=256, endpoint_bins=64, extent=(-1.0, 1.0)):
+    """
+    2D histograms of the (h, m) trajectories of all sessions.
+
+    Every frame of every session is counted in a `bins` x `bins` grid over
+    `extent` x `extent`, and the final frame of every session in a coarser
+    `endpoint_bins` grid. Bins are computed directly from the coordinates and counted
+    with one `np.bincount` per chunk, so memory and plot time do not grow with the
+    number of sessions. Points outside `extent` are left out.
+
+    Args:
+      chunks: iterable of lists of sessions with "human_inputs" and "machine_inputs",
+        such as the output of `SessionLoader.iter_load`. Read once
+      bins: number of bins per axis of the trajectory histogram
+      endpoint_bins: number of bins per axis of the endpoint histogram
+      extent: (low, high) range of both axes
+    Returns:
+      dict with "counts" of shape (bins, bins) and "endpoints" of shape
+      (endpoint_bins, endpoint_bins), both indexed [h bin, m bin], "extent" and the number
+      of "sessions"
+    """
+    counts = np.zeros(bins * bins, dtype=np.int64)
+    endpoints = np.zeros(endpoint_bins * endpoint_bins, dtype=np.int64)
+    n_sessions = 0
+    for chunk in chunks:
+        chunk = [s for s in chunk if len(s["human_inputs"])]
+        if not chunk:
+            continue
+        n_sessions += len(chunk)
+        h = np.concatenate([s["human_inputs"] for s in chunk])
+        m = np.concatenate([s["machine_inputs"] for s in chunk])
+        counts += _bin_counts(h, m, bins, extent)
+        endpoints += _bin_counts(np.array([s["human_inputs"][-1] for s in chunk]),
+                                 np.array([s["machine_inputs"][-1] for s in chunk]), endpoint_bins, extent)
+    return {"counts": counts.reshape(bins, bins), "endpoints": endpoints.reshape(endpoint_bins, endpoint_bins),
+            "extent": np.array(extent, dtype=np.float64), "sessions": np.int64(n_sessions)}
+
+def _bin_counts(h, m, bins, extent):
+    """
+    Returns the flattened (bins * bins) histogram of the points (h, m) inside `extent`
+    """
+    low, high = extent
+    scale = bins / (high - low)
+    i = np.floor((h - low) * scale)
+    j = np.floor((m - low) * scale)
+    # the upper edge belongs to the last bin, like np.histogram2d
+    i[h == high] = bins - 1
+    j[m == high] = bins - 1
+    inside = (i >= 0) & (i < bins) & (j >= 0) & (j < bins)
+    flat = i[inside].astype(np.int64) * bins + j[inside].astype(np.int64)
+    return np.bincount(flat, minlength=bins * bins)
+
+# ==========================================
+#                 TABLES
+# ==========================================
+
+def write_table(rows, file_path):
+    """
+    Writes result rows (dicts with the same keys) as a CSV table, one line per row
+    """
+    with open(file_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# headless pygame, must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+import cost
+import data
+from experiments import AI_Exp1, AI_Exp2, AI_Exp3
+
+# A benchmark is slower than the baseline when its time grows by more than this factor
+DEFAULT_THRESHOLD = 1.2
+
+# Committed results every run is compared against by default. Timings only compare on
+# the same kind of machine, the "meta" of the file says which one it was recorded on.
+# Refresh it with `python benchmark.py --out benchmark_baseline.json` when a change is
+# meant to make something slower, or when moving to other hardware
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# ==========================================
+#                 HARNESS
+# ==========================================
+
+def measure(fn, number=1, repeat=5):
+    """
+    Times `fn`
+
+    Args:
+      fn: function without arguments
+      number: calls per measurement, the time is divided by it
+      repeat: number of measurements
+    Returns:
+      dict with the min, median and max seconds per call
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {"min_s": min(times), "median_s": float(np.median(times)), "max_s": max(times),
+            "number": number, "repeat": repeat}
+
+# ==========================================
+#               BENCHMARKS
+# ==========================================
+
+def bench_costs(results):
+    h, m = 0.3, -0.1
+    results["cost.get_human_cost scalar"] = measure(lambda: cost.get_human_cost(h, m), number=10000)
+    results["cost.get_machine_cost scalar"] = measure(lambda: cost.get_machine_cost(h, m), number=10000)
+    results["cost.get_machine_gradient scalar"] = measure(lambda: cost.get_machine_gradient(h, m), number=10000)
+
+    rng = np.random.default_rng(0)
+    hs, ms = rng.uniform(-1, 1, (2, 1_000_000))
+    results["cost.get_human_cost 1e6"] = measure(lambda: cost.get_human_cost(hs, ms))
+    results["cost.get_machine_cost 1e6"] = measure(lambda: cost.get_machine_cost(hs, ms))
+    results["cost.get_machine_gradient 1e6"] = measure(lambda: cost.get_machine_gradient(hs, ms))
+
+def _agents(n_sessions=None):
+    return {
+        "AI_Exp1": AI_Exp1(alpha=0.3, n_sessions=n_sessions),
+        "AI_Exp2": AI_Exp2(180, n_sessions=n_sessions),
+        "AI_Exp3": AI_Exp3(180, gamma=1.0, n_sessions=n_sessions),
+    }
+
+def bench_agents(results):
+    for name, agent in _agents().items():
+        h = 0.1
+        results[f"{name}.get_action"] = measure(lambda: agent.get_action(h), number=10000)
+        results[f"{name}.store_frame"] = measure(lambda: agent.store_frame(h, 0.2), number=10000)
+
+    N_SESSIONS = 10000
+    h = np.random.default_rng(0).uniform(-1, 1, N_SESSIONS)
+    for name, agent in _agents(N_SESSIONS).items():
+        results[f"{name}.step batch {N_SESSIONS}"] = measure(lambda: agent.step(h), number=1000)
+
+def bench_database(results, workdir):
+    N_FRAMES = 3600
+    database = data.DataBase(N_FRAMES)
+
+    def append_round():
+        database.current_frame = 0
+        for i in range(N_FRAMES):
+            database.append(0.1, 0.2, 0.3, 0.4)
+    timing = measure(append_round)
+    results["DataBase.append"] = {k: v / N_FRAMES if k.endswith("_s") else v for k, v in timing.items()}
+    results["DataBase.write 3600 frames"] = measure(lambda: database.write("1_Bench"), repeat=10)
+
+def bench_run_round(results, workdir):
+    import pygame
+    import game
+    from game_gui import DisplaySession
+
+    class ScriptedMouse:
+        """
+        Wraps an agent and moves the mouse along a sine wave, one motion event per frame
+        """
+        def __init__(self, agent):
+            self.agent = agent
+            self.frame = 0
+
+        def get_action(self, h):
+            self.frame += 1
+            x = int(960 + 900 * np.sin(self.frame / 30))
+            pygame.event.post(pygame.event.Event(pygame.MOUSEMOTION, pos=(x, 500), rel=(0, 0), buttons=(0, 0, 0)))
+            return self.agent.get_action(h)
+
+        def store_frame(self, h, m):
+            self.agent.store_frame(h, m)
+
+        @property
+        def done(self):
+            return self.agent.done
+
+        def metadata(self):
+            return self.agent.metadata()
+
+    # no 3 second countdown
+    countdown = DisplaySession.countdown
+    DisplaySession.countdown = lambda *args, **kwargs: None
+    N_FRAMES = 600
+    try:
+        results["DisplaySession startup"] = measure(lambda: DisplaySession().close(), repeat=3)
+        with DisplaySession() as session:
+            for mode in ("dirty", "full"):
+                # a control rate high enough that every step is due at once
+                timing = measure(lambda: game.run_round(1, N_FRAMES / 1e5, ScriptedMouse(AI_Exp1()), "Bench",
+                                                        render_mode=mode, control_rate=1e5, session=session),
+                                 repeat=3)
+                results[f"run_round {mode} per frame"] = {k: v / N_FRAMES if k.endswith("_s") else v
+                                                          for k, v in timing.items()}
+        data._close_all()
+    finally:
+        DisplaySession.countdown = countdown
+
+def _generate_sessions(root, n_sessions, n_frames, seed=0):
+    """
+    Writes `n_sessions` synthetic Exp3 sessions of random length under `root`
+    """
+    rng = np.random.default_rng(seed)
+    directory = os.path.join(root, "round_3_Exp3")
+    os.makedirs(directory, exist_ok=True)
+    for i in range(n_sessions):
+        length = int(rng.integers(n_frames // 2, n_frames + 1))
+        h = np.clip(np.cumsum(rng.normal(0, 0.02, length)), -1, 1)
+        np.savez(os.path.join(directory, f"{i:010d}.npz"),
+                 human_inputs=h, machine_inputs=0.45 * h + rng.normal(0, 0.05, length),
+                 human_scores=rng.uniform(0, 0.3, length),
+                 machine_scores=rng.uniform(0, 0.1, length))
+
+def bench_plots(results, workdir, sizes, n_frames):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import visualize
+    from loading import SessionLoader
+
+    for n_sessions in sizes:
+        root = os.path.join(workdir, f"plots_{n_sessions}")
+        _generate_sessions(root, n_sessions, n_frames)
+        # no cache, so every repeat loads and aggregates from scratch
+        loader = SessionLoader(root, cache_directory=None)
+        output = os.path.join(workdir, "plot.png")
+
+        def plot():
+            visualize.plot_learning_experiments(3, "Benchmark", output, loader)
+            plt.close("all")
+        results[f"visualize.plot_learning_experiments {n_sessions} sessions"] = \
+            measure(plot, repeat=3 if n_sessions <= 1000 else 1)
+
+        def plot_density():
+            visualize.plot_action_density(3, "Benchmark", output, loader)
+            plt.close("all")
+        results[f"visualize.plot_action_density {n_sessions} sessions"] = \
+            measure(plot_density, repeat=3 if n_sessions <= 1000 else 1)
+        shutil.rmtree(root)
+
+# ==========================================
+#            BASELINE COMPARISON
+# ==========================================
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the min time of every benchmark with the baseline
+
+    Returns:
+      list of (name, baseline seconds, current seconds, ratio) for benchmarks more than
+      `threshold` times slower than the baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["min_s"] / baseline[name]["min_s"]
+        print(f"  {name:55s} {ratio:6.2f}x")
+        if ratio > threshold:
+            regressions.append((name, baseline[name]["min_s"], result["min_s"], ratio))
+    return regressions
+
+if __name__ == "__main__":
+    SUITES = ("costs", "agents", "database", "run_round", "plots")
+    parser = argparse.ArgumentParser(description="Headless benchmark suite")
+    parser.add_argument("--suites", nargs="*", default=list(SUITES), choices=SUITES)
+    parser.add_argument("--plot-sizes", nargs="*", type=int, default=[10, 1000, 100000],
+                        help="number of generated sessions for the plot benchmarks")
+    parser.add_argument("--plot-frames", type=int, default=360,
+                        help="frames of the longest generated session")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="JSON results to compare against, defaults to the committed baseline. "
+                             "An empty string skips the comparison")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown factor reported as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    # DataBase writes under ./data, keep it out of the repository
+    os.chdir(workdir)
+    try:
+        for suite in args.suites:
+            print(f"Running {suite} benchmarks...")
+            if suite == "costs":
+                bench_costs(results)
+            elif suite == "agents":
+                bench_agents(results)
+            elif suite == "database":
+                bench_database(results, workdir)
+            elif suite == "run_round":
+                bench_run_round(results, workdir)
+            elif suite == "plots":
+                bench_plots(results, workdir, args.plot_sizes, args.plot_frames)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "meta": {
+            "time": time.time(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=2)
+    for name, result in results.items():
+        print(f"  {name:55s} {result['min_s'] * 1e6:12.2f} us")
+    print(f"Saved {args.out}")
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        print(f"Compared with {args.baseline}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks are more than {args.threshold}x slower than the baseline")
+            sys.exit(1)
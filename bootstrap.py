@@ -0,0 +1,281 @@
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from aggregate import pad_ragged, moving_average, convergence_time, write_table
+from loading import SESSION_KEYS, SessionLoader, ArchiveLoader
+
+# Largest number of entries of the resampling index matrix built at once
+CHUNK_ELEMENTS = 2 ** 22
+
+# Per session metrics of `session_metrics`
+METRICS = ("final_machine_cost", "final_human_cost", "convergence_frames", "L_M")
+
+# ==========================================
+#            PER SESSION METRICS
+# ==========================================
+
+def _frames_before_end(stack, lengths, start, stop):
+    """
+    Returns the frames `lengths - start` up to `lengths - stop` of every session, NaN
+    where a session is too short
+    """
+    cols = lengths[:, None] - start + np.arange(start - stop)
+    rows = np.arange(len(stack))[:, None]
+    return np.where(cols >= 0, stack[rows, np.clip(cols, 0, None)], np.nan)
+
+def _nanmean(x, axis):
+    count = np.sum(~np.isnan(x), axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(x, axis=axis) / count
+
+def _policy_slope(sessions, lengths, trial_frames):
+    """
+    Least squares slope of m on h over the frames `2 * trial_frames` to `trial_frames`
+    before the end of every session
+    """
+    h = _frames_before_end(pad_ragged([s["human_inputs"] for s in sessions]), lengths,
+                           2 * trial_frames, trial_frames)
+    m = _frames_before_end(pad_ragged([s["machine_inputs"] for s in sessions]), lengths,
+                           2 * trial_frames, trial_frames)
+    dh = h - _nanmean(h, axis=1)[:, None]
+    dm = m - _nanmean(m, axis=1)[:, None]
+    var_h = np.nansum(dh * dh, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(var_h > 1e-12, np.nansum(dh * dm, axis=1) / var_h, np.nan)
+
+def session_metrics(sessions, trial_frames=180, window=100, tolerance=0.02, policy=True):
+    """
+    Computes the metrics compared between experiments, for every session
+
+      final_machine_cost, final_human_cost: mean cost over the last `trial_frames` frames
+      convergence_frames: first frame after which the machine cost, smoothed over
+        `window` frames, stays within `tolerance` of its final value
+      L_M: final policy slope, the last entry of the `L_M_history` the agent saved. Older
+        recordings without it fall back to the least squares slope of m on h over the
+        frames `2 * trial_frames` to `trial_frames` before the end of the session, the
+        last nominal trial of a one sided agent
+
+    Args:
+      sessions: list of dicts of arrays, as returned by `SessionLoader.load`
+      trial_frames: frames per trial (mini round)
+      window: moving average window of the convergence time
+      tolerance: tolerance of the convergence time, see `aggregate.convergence_time`
+      policy: False for experiments without a policy slope, e.g. Exp1. L_M is then NaN
+    Returns:
+      dict mapping each name in `METRICS` to an array of shape (n_sessions,), NaN where
+      a session is too short for the metric
+    """
+    machine = pad_ragged([s["machine_scores"] for s in sessions])
+    human = pad_ragged([s["human_scores"] for s in sessions])
+    lengths = np.sum(~np.isnan(machine), axis=1)
+
+    metrics = {
+        "final_machine_cost": _nanmean(_frames_before_end(machine, lengths, trial_frames, 0), axis=1),
+        "final_human_cost": _nanmean(_frames_before_end(human, lengths, trial_frames, 0), axis=1),
+    }
+    smooth = moving_average(machine, window, axis=1) if machine.shape[1] > window else machine
+    metrics["convergence_frames"] = convergence_time(smooth, metrics["final_machine_cost"], tolerance)
+
+    if policy:
+        saved = np.array([s["L_M_history"][-1] if len(s.get("L_M_history", ())) else np.nan
+                          for s in sessions], dtype=np.float64)
+        metrics["L_M"] = np.where(np.isnan(saved), _policy_slope(sessions, lengths, trial_frames), saved)
+    else:
+        metrics["L_M"] = np.full(len(sessions), np.nan)
+    return metrics
+
+# ==========================================
+#                BOOTSTRAP
+# ==========================================
+
+def _resample(values, statistic, n_resamples, seed):
+    """
+    Returns `statistic` of `n_resamples` resamples of `values`, drawn as one index matrix
+    """
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    index = rng.integers(0, n, (n_resamples, n))
+    if statistic == "mean":
+        # the mean only needs how often each session was drawn, a matrix product
+        flat = (index + n * np.arange(n_resamples)[:, None]).ravel()
+        counts = np.bincount(flat, minlength=n_resamples * n).reshape(n_resamples, n)
+        return counts.astype(np.float64) @ values / n
+    return np.median(values[index], axis=1)
+
+def bootstrap(values, n_resamples=10000, statistic="mean", ci=0.95, seed=0, workers=1,
+              chunk_elements=CHUNK_ELEMENTS):
+    """
+    Percentile bootstrap confidence interval of the mean or median of `values`.
+
+    Resamples are drawn as index matrices of shape (resamples, sessions), at most
+    `chunk_elements` entries at a time. Each chunk has its own seed, so the result only
+    depends on `seed`, not on `workers`.
+
+    Args:
+      values: 1D array, one value per session. NaN values are left out
+      n_resamples: number of bootstrap resamples
+      statistic: "mean" or "median"
+      ci: confidence level
+      seed: seed for the random number generator, an int or a `np.random.SeedSequence`
+      workers: number of processes, 1 resamples in this process
+      chunk_elements: largest index matrix built at once
+    Returns:
+      dict with the `estimate` on the original data, the `low` and `high` ends of the
+      interval, the number `n` of values and the bootstrap distribution `samples`
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n == 0:
+        return {"estimate": np.nan, "low": np.nan, "high": np.nan, "n": 0, "samples": np.full(n_resamples, np.nan)}
+
+    chunk = max(1, chunk_elements // n)
+    sizes = [min(chunk, n_resamples - start) for start in range(0, n_resamples, chunk)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+    if workers == 1 or len(sizes) == 1:
+        samples = [_resample(values, statistic, size, s) for size, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            samples = list(pool.map(_resample, itertools.repeat(values), itertools.repeat(statistic),
+                                    sizes, seeds))
+    samples = np.concatenate(samples)
+
+    alpha = (1.0 - ci) / 2
+    estimate = np.mean(values) if statistic == "mean" else np.median(values)
+    return {"estimate": float(estimate), "low": float(np.quantile(samples, alpha)),
+            "high": float(np.quantile(samples, 1.0 - alpha)), "n": n, "samples": samples}
+
+def difference(a, b, ci=0.95):
+    """
+    Confidence interval of the difference between two experiments, from their
+    `bootstrap` results. Both need the same number of resamples
+
+    Returns:
+      dict with the `estimate`, `low` and `high` of a - b
+    """
+    samples = a["samples"] - b["samples"]
+    alpha = (1.0 - ci) / 2
+    return {"estimate": a["estimate"] - b["estimate"], "low": float(np.nanquantile(samples, alpha)),
+            "high": float(np.nanquantile(samples, 1.0 - alpha))}
+
+def bootstrap_mean_curves(chunks, keys, n_resamples=500, ci=0.95, window=100, seed=0):
+    """
+    Confidence bands of the mean curve over time, e.g. the mean machine cost per frame.
+
+    Streams over the sessions chunk by chunk, so it never holds all sessions. Index
+    matrices need every session at once, so this uses the Poisson bootstrap instead:
+    each session gets an independent Poisson(1) weight per resample, and a resampled
+    mean curve is a weighted mean, one matrix product per chunk. Sessions of different
+    lengths only count at the frames they have.
+
+    Args:
+      chunks: iterable of lists of sessions, as returned by `SessionLoader.iter_load`
+      keys: arrays to compute bands for, e.g. ("machine_scores",)
+      n_resamples: number of bootstrap resamples
+      ci: confidence level
+      window: moving average window applied to every curve
+      seed: seed for the random number generator
+    Returns:
+      dict mapping "{key}_mean", "{key}_low" and "{key}_high" to 1D arrays
+    """
+    rng = np.random.default_rng(seed)
+    sums = {key: np.zeros((n_resamples + 1, 0)) for key in keys}
+    counts = {key: np.zeros((n_resamples + 1, 0)) for key in keys}
+    for chunk in chunks:
+        # row 0 has unit weights, the plain mean
+        weights = np.vstack([np.ones((1, len(chunk))), rng.poisson(1.0, (n_resamples, len(chunk)))])
+        for key in keys:
+            stack = pad_ragged([s[key] for s in chunk])
+            valid = ~np.isnan(stack)
+            n_frames = stack.shape[1]
+            if n_frames > sums[key].shape[1]:
+                sums[key] = np.pad(sums[key], ((0, 0), (0, n_frames - sums[key].shape[1])))
+                counts[key] = np.pad(counts[key], ((0, 0), (0, n_frames - counts[key].shape[1])))
+            sums[key][:, :n_frames] += weights @ np.where(valid, stack, 0.0)
+            counts[key][:, :n_frames] += weights @ valid
+
+    result = {}
+    alpha = (1.0 - ci) / 2
+    for key in keys:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            curves = sums[key] / counts[key]
+        if curves.shape[1] > window:
+            curves = moving_average(curves, window, axis=1)
+        result[f"{key}_mean"] = curves[0]
+        result[f"{key}_low"] = np.nanquantile(curves[1:], alpha, axis=0) if curves.size else curves[0]
+        result[f"{key}_high"] = np.nanquantile(curves[1:], 1.0 - alpha, axis=0) if curves.size else curves[0]
+    return result
+
+# ==========================================
+#           EXPERIMENT COMPARISON
+# ==========================================
+
+def compare_experiments(loader, experiments=(1, 2, 3), n_resamples=10000, statistic="mean", ci=0.95,
+                        trial_frames=180, seed=0, workers=1):
+    """
+    Bootstraps every metric of `session_metrics` for every experiment, and the difference
+    between every pair of experiments
+
+    Returns:
+      list of table rows (dicts), one per experiment or pair of experiments and metric
+    """
+    results = {}
+    rows = []
+    for round_num in experiments:
+        files = loader.files(round_num, f"Exp{round_num}")
+        if not files:
+            print(f"  No data found for Round {round_num}.")
+            continue
+        metrics = session_metrics(loader.load(files, SESSION_KEYS + ("L_M_history",)), trial_frames,
+                                  policy=round_num != 1)
+        results[round_num] = {}
+        for name in METRICS:
+            # the experiments are independent samples, each gets its own child seed so
+            # experiments of the same size are not resampled with the same index matrices.
+            # Keyed by the experiment number, an interval does not depend on which other
+            # experiments are compared
+            experiment_seed = np.random.SeedSequence(seed, spawn_key=(round_num,))
+            result = bootstrap(metrics[name], n_resamples, statistic, ci, experiment_seed, workers)
+            results[round_num][name] = result
+            rows.append({"experiment": f"Exp{round_num}", "metric": name, "statistic": statistic,
+                         "n": result["n"], "estimate": result["estimate"],
+                         "low": result["low"], "high": result["high"]})
+
+    for a, b in itertools.combinations(results, 2):
+        for name in METRICS:
+            if results[a][name]["n"] == 0 or results[b][name]["n"] == 0:
+                continue
+            result = difference(results[a][name], results[b][name], ci)
+            rows.append({"experiment": f"Exp{a} - Exp{b}", "metric": name, "statistic": statistic,
+                         "n": "", "estimate": result["estimate"], "low": result["low"], "high": result["high"]})
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals of the experiment metrics")
+    parser.add_argument("--data-root", default="data", help="directory holding the round_* folders")
+    parser.add_argument("--archives", nargs="*", default=None, metavar="ZIP",
+                        help="read the sessions straight from zip archives, e.g. data.zip data1.zip")
+    parser.add_argument("--experiments", nargs="*", type=int, default=[1, 2, 3], choices=[1, 2, 3])
+    parser.add_argument("--resamples", type=int, default=10000)
+    parser.add_argument("--statistic", default="mean", choices=["mean", "median"])
+    parser.add_argument("--ci", type=float, default=0.95, help="confidence level")
+    parser.add_argument("--trial-frames", type=int, default=180, help="frames per mini round")
+    parser.add_argument("--workers", type=int, default=1, help="number of resampling processes")
+    parser.add_argument("--out", default="bootstrap_results.csv")
+    args = parser.parse_args()
+
+    if args.archives:
+        loader = ArchiveLoader(args.archives)
+    else:
+        loader = SessionLoader(args.data_root)
+    rows = compare_experiments(loader, args.experiments, args.resamples, args.statistic, args.ci,
+                               args.trial_frames, workers=args.workers)
+    for row in rows:
+        print(f"{row['experiment']:>12s} {row['metric']:>20s}: {row['estimate']:10.4f} "
+              f"[{row['low']:10.4f}, {row['high']:10.4f}]")
+    if rows:
+        write_table(rows, args.out)
+        print(f"Saved {len(rows)} rows to {args.out}")
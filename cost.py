@@ -1,3 +1,6 @@
+import functools
+import numpy as np
+
 # Human Cost Parameters
 AH, BH, DH = 1.0, -1.0/3.0, 7.0/15.0
 hH, mH = 0.1, 0.7
@@ -6,6 +9,169 @@ hH, mH = 0.1, 0.7
 AM, BM, DM = 1.0, -1.0, 2.0
 hM, mM = 0.0, 0.0
 
+class QuadraticGame:
+    """
+    Two player quadratic game between the human (action h) and the machine (action m).
+
+    Each player's cost is a quadratic in its own action `u` and the other player's action
+    `v`, both measured from the player's center:
+
+      c(u, v) = 1/2 * A * u^2 + B * u * v + 1/2 * D * v^2
+
+    so the human uses u = h - hH, v = m - mH and the machine u = m - mM, v = h - hM.
+    In (h, m) coordinates this is c(x) = 1/2 x^T Q x + q^T x + k, available as
+    `human_Q`, `human_q`, `human_k` and `machine_Q`, `machine_q`, `machine_k`.
+
+    Every parameter may be an array, in which case it broadcasts against the (h, m)
+    arrays with the usual numpy rules. This evaluates a whole stack of parameter sets in
+    one call, e.g. parameters of shape (P, 1) against actions of shape (N,) give (P, N).
+    """
+    def __init__(self, AH, BH, DH, hH, mH, AM, BM, DM, hM, mM, clip_human=True):
+        """
+        Args:
+          AH, BH, DH: human cost coefficients
+          hH, mH: center of the human cost
+          AM, BM, DM: machine cost coefficients
+          hM, mM: center of the machine cost
+          clip_human: clip the human cost at 0 so it is safe to take its square root
+        """
+        self.AH, self.BH, self.DH = (np.asarray(p, dtype=np.float64) for p in (AH, BH, DH))
+        self.hH, self.mH = (np.asarray(p, dtype=np.float64) for p in (hH, mH))
+        self.AM, self.BM, self.DM = (np.asarray(p, dtype=np.float64) for p in (AM, BM, DM))
+        self.hM, self.mM = (np.asarray(p, dtype=np.float64) for p in (hM, mM))
+        self.clip_human = clip_human
+
+    # ---------- Matrix / vector form ----------
+
+    @functools.cached_property
+    def human_Q(self):
+        """Hessian of the human cost w.r.t (h, m), shape (..., 2, 2)"""
+        return self._stack_matrix(self.AH, self.BH, self.DH)
+
+    @functools.cached_property
+    def machine_Q(self):
+        """Hessian of the machine cost w.r.t (h, m), shape (..., 2, 2)"""
+        return self._stack_matrix(self.DM, self.BM, self.AM)
+
+    @functools.cached_property
+    def human_q(self):
+        return -np.einsum("...ij,...j->...i", self.human_Q, self._stack_vector(self.hH, self.mH))
+
+    @functools.cached_property
+    def machine_q(self):
+        return -np.einsum("...ij,...j->...i", self.machine_Q, self._stack_vector(self.hM, self.mM))
+
+    @functools.cached_property
+    def human_k(self):
+        center = self._stack_vector(self.hH, self.mH)
+        return 0.5 * np.einsum("...i,...ij,...j->...", center, self.human_Q, center)
+
+    @functools.cached_property
+    def machine_k(self):
+        center = self._stack_vector(self.hM, self.mM)
+        return 0.5 * np.einsum("...i,...ij,...j->...", center, self.machine_Q, center)
+
+    @staticmethod
+    def _stack_matrix(hh, hm, mm):
+        hh, hm, mm = np.broadcast_arrays(hh, hm, mm)
+        return np.stack([np.stack([hh, hm], axis=-1), np.stack([hm, mm], axis=-1)], axis=-2)
+
+    @staticmethod
+    def _stack_vector(h, m):
+        return np.stack(np.broadcast_arrays(h, m), axis=-1)
+
+    def human_hessian(self):
+        return self.human_Q
+
+    def machine_hessian(self):
+        return self.machine_Q
+
+    # ---------- Costs and gradients ----------
+
+    def human_cost(self, h, m):
+        """
+        Human cost for arrays of human inputs `h` and machine inputs `m`
+        """
+        u, v = h - self.hH, m - self.mH
+        val = 0.5 * self.AH * u * u + self.BH * u * v + 0.5 * self.DH * v * v
+        return np.maximum(0.0, val) if self.clip_human else val
+
+    def machine_cost(self, h, m):
+        """
+        Machine cost for arrays of human inputs `h` and machine inputs `m`
+        """
+        u, v = m - self.mM, h - self.hM
+        return 0.5 * self.AM * u * u + self.BM * u * v + 0.5 * self.DM * v * v
+
+    def human_gradient(self, h, m):
+        """
+        d(c_H)/dh = AH*(h-hH) + BH*(m-mH)
+        """
+        return self.AH * (h - self.hH) + self.BH * (m - self.mH)
+
+    def machine_gradient(self, h, m):
+        """
+        d(c_M)/dm = AM*(m-mM) + BM*(h-hM)
+        """
+        return self.AM * (m - self.mM) + self.BM * (h - self.hM)
+
+    # ---------- Best responses and equilibria ----------
+
+    def human_best_response(self, m):
+        """
+        h = hH - (BH/AH)*(m - mH), the minimizer of the human cost for a fixed m
+        """
+        return self.hH - (self.BH / self.AH) * (m - self.mH)
+
+    def machine_best_response(self, h):
+        """
+        m = mM - (BM/AM)*(h - hM), the minimizer of the machine cost for a fixed h
+        """
+        return self.mM - (self.BM / self.AM) * (h - self.hM)
+
+    @functools.cached_property
+    def nash(self):
+        """
+        (h, m) where both players are best responding to each other
+        """
+        a = -self.BH / self.AH
+        b = -self.BM / self.AM
+        h = (self.hH + a * (self.mM - self.mH - b * self.hM)) / (1.0 - a * b)
+        return h, self.machine_best_response(h)
+
+    @functools.cached_property
+    def stackelberg(self):
+        """
+        (h, m) when the machine leads in action space and the human best responds
+        """
+        a = -self.BH / self.AH
+        # machine cost along the human best response, v = v0 + a * u
+        v0 = self.hH - self.hM + a * (self.mM - self.mH)
+        u = -v0 * (self.BM + a * self.DM) / (self.AM + 2.0 * a * self.BM + a * a * self.DM)
+        m = self.mM + u
+        return self.human_best_response(m), m
+
+    @functools.cached_property
+    def optimal_policy_slope(self):
+        """
+        Slope L of the machine policy m = L*(h - hM) + mM that is optimal for the machine.
+
+        The machine cost has its global minimum at (hM, mM). The policy always passes
+        through that point, so the optimal slope is the one that makes h = hM the human's
+        best response to the policy: d(c_H)/dh + L * d(c_H)/dm = 0 at (hM, mM).
+        This is the slope `AI_Exp2` and `AI_Exp3` should learn.
+        """
+        dh = self.AH * (self.hM - self.hH) + self.BH * (self.mM - self.mH)
+        dm = self.BH * (self.hM - self.hH) + self.DH * (self.mM - self.mH)
+        return -dh / dm
+
+GAME = QuadraticGame(AH, BH, DH, hH, mH, AM, BM, DM, hM, mM)
+
+# The functions below are called once per frame with plain numbers. Those stay on float
+# arithmetic, a trip through the numpy arrays of `GAME` costs several microseconds each.
+# Arrays, e.g. the batched sessions of `simulation.py`, go through `GAME`
+_SCALARS = (int, float)
+
 def get_human_cost(human_input, machine_input):
     """
     Calculates human cost from 3D quadratic equation
@@ -16,21 +182,12 @@ def get_human_cost(human_input, machine_input):
     Returns:
       returns the cost of the human player. Output is in the range [0, 596 / 375]
     """
-
-    # TODO fully implement. Note that the actual values could be slightly negative. It may
-    # dummy function should be replaced with actual equation
-
-    # It may be worth adding 12/125 
-    # Calculate the raw cost
-    val = (1 / 2) * human_input ** 2 \
-        + (7 / 30)  * machine_input ** 2 \
-        - (1/3) * human_input * machine_input \
-        + (2 / 15) * human_input  \
-        - (22/ 75) * machine_input
-        
-    # FIX: Add the offset (+ 12/125) AND max(0) safety check
-    # This ensures game_gui.py never crashes on math.sqrt()
-    return max(0.0, val + (12/125))
+    # The centered form already includes the 12/125 offset of the paper's equation and
+    # clips at 0, so game_gui.py never crashes on math.sqrt()
+    if isinstance(human_input, _SCALARS) and isinstance(machine_input, _SCALARS):
+        u, v = human_input - hH, machine_input - mH
+        return max(0.0, 0.5 * AH * u * u + BH * u * v + 0.5 * DH * v * v)
+    return GAME.human_cost(human_input, machine_input)
 
 def get_machine_cost(human_input, machine_input):
     """
@@ -42,14 +199,27 @@ def get_machine_cost(human_input, machine_input):
     Returns:
       returns the cost of the human player. Output has minium of 0
     """
-    return (1 / 2) * machine_input ** 2 \
-        + human_input ** 2 \
-        - human_input * machine_input
-        
+    if isinstance(human_input, _SCALARS) and isinstance(machine_input, _SCALARS):
+        u, v = machine_input - mM, human_input - hM
+        return 0.5 * AM * u * u + BM * u * v + 0.5 * DM * v * v
+    return GAME.machine_cost(human_input, machine_input)
+
 def get_machine_gradient(h, m):
     """
     Analytic Gradient of Machine Cost w.r.t 'm'.
     Used for Experiment 1 (Gradient Descent).
     d(c_M)/dm = AM*(m-mM) + BM*(h-hM)
     """
-    return AM * (m - mM) + BM * (h - hM)
\ No newline at end of file
+    if isinstance(h, _SCALARS) and isinstance(m, _SCALARS):
+        return AM * (m - mM) + BM * (h - hM)
+    return GAME.machine_gradient(h, m)
+
+def get_human_gradient(h, m):
+    """
+    Analytic Gradient of Human Cost w.r.t 'h'.
+    Used by the synthetic humans in `simulation.py`.
+    d(c_H)/dh = AH*(h-hH) + BH*(m-mH)
+    """
+    if isinstance(h, _SCALARS) and isinstance(m, _SCALARS):
+        return AH * (h - hH) + BH * (m - mH)
+    return GAME.human_gradient(h, m)
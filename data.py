@@ -1,50 +1,148 @@
 import numpy as np
+import atexit
+import glob
 import os
+import queue
+import shutil
+import signal
+import sys
+import threading
 import uuid
 
+DATA_DIRECTORY = "data"
+
+# Streaming databases whose writer thread may still have work to do, see `_close_all`
+_open_databases = set()
+
+# File in a `.part` directory holding the pid of the process streaming into it
+OWNER_FILE = "owner.pid"
+
+# Columns of the frame buffer, in the order `DataBase.append` takes them
+COLUMNS = ("human_inputs", "machine_inputs", "human_scores", "machine_scores")
+
 class DataBase:
     """
-    Stores the data for a **single round** of the game. 
+    Stores the data for a **single round** of the game.
+
+    Frames are kept in one structured array with a field per column, grown in whole
+    chunks when full, so appending is amortized O(1) and a round that runs longer than
+    planned never loses frames. `window` returns zero-copy views of recorded frames,
+    which is how the agents read their trial statistics, see `TrialAgent.use_buffer`.
+
+    When created with a `round_num` the database streams the round to disk while it is
+    being played. Every `chunk_frames` frames the new frames are handed to a background
+    writer thread, which saves them uncompressed under `data/round_{round_num}/{hash}.part/`.
+    `write` then compresses the full round on the writer thread as well, so neither the
+    chunk writes nor the compression ever run on the frame loop. If the round is cut
+    short, `close` (also called on exit and on SIGTERM) saves what was recorded and marks
+    it incomplete, and `recover_partial_rounds` rebuilds rounds from the chunks left
+    behind by a crash.
     """
-    def __init__(self, n_frames):
+    def __init__(self, n_frames, round_num=None, chunk_frames=300, dtype=np.float64):
         """
         Initializes of database. For speed specifieds initial array size
 
         Args:
-          n_frames: the number of frames intented to be stored
+          n_frames: the number of frames intented to be stored, more frames grow the buffer
+          round_num: round name in the form `{round}_{label}`. Enables streaming writes
+          chunk_frames: number of frames per chunk flushed to disk while streaming, and
+            smallest step the buffer grows by
+          dtype: dtype of every column, float32 halves the memory and file size
         """
-        self.human_scores = np.zeros(n_frames, dtype=np.float64)
-        self.machine_scores = np.zeros(n_frames, dtype=np.float64)
-        self.human_inputs = np.zeros(n_frames, dtype=np.float64)
-        self.machine_inputs = np.zeros(n_frames, dtype=np.float64)
+        self.dtype = np.dtype([(name, dtype) for name in COLUMNS])
+        self.chunk_frames = chunk_frames
+        self.buffer = np.zeros(max(n_frames, 1), dtype=self.dtype)
         self.current_frame = 0
-        self.warned = False
-        
+        # additional arrays saved with the round, see `attach`
+        self.extra = {}
+
+        self.round_num = round_num
+        self.file_hash = self._file_hash()
+        self.flushed_frames = 0
+        self.closed = False
+        self._writer = None
+        if round_num is not None:
+            self.directory = os.path.join(DATA_DIRECTORY, f"round_{round_num}")
+            self.part_directory = os.path.join(self.directory, f"{self.file_hash}.part")
+            # marks the chunks as this process's, so recovery leaves a live round alone.
+            # The directory only appears under its name with the owner file inside
+            os.makedirs(self.part_directory + ".tmp")
+            with open(os.path.join(self.part_directory + ".tmp", OWNER_FILE), "w") as f:
+                f.write(str(os.getpid()))
+            os.rename(self.part_directory + ".tmp", self.part_directory)
+            self._writer = _Writer()
+            self._writer.start()
+            _open_databases.add(self)
+            _install_signal_handler()
+
     def append(self, human_input, machine_input, human_score, machine_score):
         """
         Appends data for a single frame of the game.
 
-        The term append is used somewhat loosely here, data should not exceed the allocated
-        `n_fames` from the initializer
-
         Args:
           human_input: numeric human input value for the frame
           machine_input: numeric machine input value for the frame
           human_score: human score for the frame
           machine_score: machine score for the frame
         """
-        if self.current_frame >= len(self.human_inputs):
-            if not self.warned:
-                print("Warning: frames exceed allocated array size. No more data is being stored")
-                self.warned = True
-            return
-        self.human_inputs[self.current_frame] = human_input
-        self.machine_inputs[self.current_frame] = machine_input
-        self.human_scores[self.current_frame] = human_score
-        self.machine_scores[self.current_frame] = machine_score
+        if self.current_frame >= len(self.buffer):
+            self._grow()
+        self.buffer[self.current_frame] = (human_input, machine_input, human_score, machine_score)
 
         self.current_frame += 1
 
+        if self._writer is not None and self.current_frame - self.flushed_frames >= self.chunk_frames:
+            self._flush()
+
+    def _grow(self):
+        """
+        Doubles the buffer, rounded up to whole chunks. Views handed out earlier keep
+        pointing at the old buffer, which still holds the same frames
+        """
+        capacity = len(self.buffer) * 2
+        capacity = -(-capacity // self.chunk_frames) * self.chunk_frames
+        grown = np.zeros(capacity, dtype=self.dtype)
+        grown[:self.current_frame] = self.buffer[:self.current_frame]
+        self.buffer = grown
+
+    def window(self, start=0, stop=None):
+        """
+        Returns a zero-copy view of the recorded frames `start:stop`
+
+        Negative indices count back from the last recorded frame, e.g. `window(-180)` is
+        the last 180 frames. The view is a structured array, e.g. `view["human_inputs"]`,
+        valid until the next `append`
+        """
+        return self.buffer[:self.current_frame][start:stop]
+
+    def attach(self, arrays):
+        """
+        Adds arrays that are saved next to the per-frame data, e.g. frame timings
+
+        Args:
+          arrays: dict mapping names to arrays of any length
+        """
+        self.extra.update(arrays)
+
+    def _frames(self):
+        """
+        Returns the recorded frames of every column by name, as views
+        """
+        frames = self.window()
+        return {name: frames[name] for name in COLUMNS}
+
+    def _flush(self):
+        """
+        Hands the frames recorded since the last flush to the writer thread
+        """
+        start, stop = self.flushed_frames, self.current_frame
+        if self.closed or stop <= start:
+            return
+        # frames are never overwritten, so views are safe to pass to the writer
+        chunk = {name: column[start:stop] for name, column in self._frames().items()}
+        self._writer.submit(_write_chunk, self.part_directory, start, chunk)
+        self.flushed_frames = stop
+
     def _file_hash(self):
         """
         Returns a randomly generated, unique file hash
@@ -52,26 +150,188 @@ class DataBase:
         LENGTH = 10
         hash = str(uuid.uuid4()).replace('-', '')[:LENGTH]
         return hash
-    
-    def write(self, round_num):
+
+    def write(self, round_num, store=None, params=None, complete=True):
         """
         Writes the data to a new file under `data/round_{round_num}`.
 
-        Each round will have a unique hash to avoid duplicates
+        Each round will have a unique hash to avoid duplicates. A streaming database
+        returns immediately, the file is written by the background writer thread.
+
+        Args:
+          round_num: round name in the form `{round}_{label}`, e.g. "1_Exp1". Ignored by a
+            streaming database, which uses the `round_num` it was created with
+          store: optional `store.SessionStore`. If given the round is appended to the store
+            instead of being written to its own file
+          params: optional dict of agent parameters saved with the round in the store
+          complete: False for a round cut short, saved as the `complete` flag
         """
-        DATA_DIRECTORY = "data"
+        if self._writer is not None:
+            self._finish(complete, store, params)
+            return
+
         directory = os.path.join(DATA_DIRECTORY, f"round_{round_num}")
-        # generate random filename to avoid duplicates
-        file_path = os.path.join(directory, f"{self._file_hash()}.npz")
-
-        os.makedirs(directory, exist_ok=True)
-
-        data_to_save: dict[str, np.ndarray] = {
-            "human_inputs": self.human_inputs,
-            "machine_inputs": self.machine_inputs,
-            "human_scores": self.human_scores,
-            "machine_scores": self.machine_scores
-        }
-        
-        np.savez_compressed(file_path, **data_to_save, allow_pickle=True)
-        
+        if store is None:
+            os.makedirs(directory, exist_ok=True)
+        frames = self._frames()
+        frames.update(self.extra)
+        _write_round(directory, self.file_hash, frames, complete, store, round_num, params)
+
+    def close(self):
+        """
+        Finalizes a streaming round, blocking until all of its data is on disk.
+
+        If `write` was not called the frames recorded so far are saved and marked as
+        incomplete. Safe to call more than once.
+        """
+        if self._writer is None:
+            return
+        self._finish(False)
+        self._writer.join()
+        _open_databases.discard(self)
+
+    def _finish(self, complete, store=None, params=None):
+        """
+        Queues the final write of a streaming round and stops the writer thread
+        """
+        if self.closed:
+            return
+        self._flush()
+        self.closed = True
+        frames = self._frames()
+        frames.update(self.extra)
+        self._writer.submit(_write_round, self.directory, self.file_hash, frames, complete,
+                            store, self.round_num, params)
+        self._writer.stop()
+
+class _Writer(threading.Thread):
+    """
+    Background thread running the file writes of a streaming `DataBase` in order
+    """
+    def __init__(self):
+        # daemon, so a pending writer never blocks interpreter shutdown before `atexit`
+        # had the chance to finalize it
+        super().__init__(name="DataBase writer", daemon=True)
+        self.jobs = queue.Queue()
+
+    def submit(self, job, *args):
+        self.jobs.put((job, args))
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def run(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                return
+            job, args = item
+            try:
+                job(*args)
+            except Exception as e:
+                print(f"Warning: failed to write round data: {e}")
+
+def _write_chunk(part_directory, start, chunk):
+    """
+    Saves one uncompressed chunk. Written to a temporary file first so a crash never
+    leaves a truncated chunk behind
+    """
+    file_path = os.path.join(part_directory, f"chunk_{start:08d}.npz")
+    with open(file_path + ".tmp", "wb") as f:
+        np.savez(f, **chunk)
+    os.replace(file_path + ".tmp", file_path)
+
+def _write_round(directory, file_hash, frames, complete, store, round_num, params):
+    """
+    Saves a whole round, compressed, and removes its chunks
+    """
+    if store is not None:
+        round_id, _, label = str(round_num).partition("_")
+        store.append(frames, int(round_id), label or f"Exp{round_id}", file_hash, dict(params or {}, complete=complete))
+    else:
+        file_path = os.path.join(directory, f"{file_hash}.npz")
+        with open(file_path + ".tmp", "wb") as f:
+            np.savez_compressed(f, **frames, complete=np.bool_(complete))
+        os.replace(file_path + ".tmp", file_path)
+    shutil.rmtree(os.path.join(directory, f"{file_hash}.part"), ignore_errors=True)
+
+def recover_partial_rounds(data_directory=DATA_DIRECTORY):
+    """
+    Rebuilds rounds left behind as chunks by a crashed or killed game.
+
+    Each recovered round is saved as a regular `.npz` with `complete` set to False.
+    Rounds still being streamed by a running process, e.g. `server.py` or this one, are
+    left alone. Chunks of a round whose `.npz` was already written are only removed.
+
+    Args:
+      data_directory: the directory holding the `round_*` folders
+    Returns:
+      the number of recovered rounds
+    """
+    count = 0
+    for part_directory in glob.glob(os.path.join(data_directory, "round_*", "*.part")):
+        if _owner_alive(part_directory):
+            continue
+        file_hash = os.path.basename(part_directory)[:-len(".part")]
+        if os.path.exists(os.path.join(os.path.dirname(part_directory), f"{file_hash}.npz")):
+            # the crash came after the final write, the round is complete
+            shutil.rmtree(part_directory, ignore_errors=True)
+            continue
+        chunks = [np.load(f) for f in sorted(glob.glob(os.path.join(part_directory, "chunk_*.npz")))]
+        if not chunks:
+            shutil.rmtree(part_directory, ignore_errors=True)
+            continue
+        frames = {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0].files}
+        _write_round(os.path.dirname(part_directory), file_hash, frames, False, None, None, None)
+        count += 1
+    return count
+
+def _owner_alive(part_directory):
+    """
+    Returns True if the process that created `part_directory` is still running
+    """
+    try:
+        with open(os.path.join(part_directory, OWNER_FILE)) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        # written before owners were recorded, or the owner file never made it to disk
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, owned by another user
+        return True
+    return True
+
+def _install_signal_handler():
+    """
+    Turns SIGTERM into a normal exit, so open rounds are finalized by `_close_all`
+    """
+    if threading.current_thread() is threading.main_thread() \
+            and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+@atexit.register
+def _close_all():
+    """
+    Finalizes every streaming round still open or still being written on exit
+    """
+    for database in list(_open_databases):
+        database.close()
+
+if __name__ == "__main__":
+    print(f"Recovered {recover_partial_rounds()} partial rounds")
@@ -1,139 +1,606 @@
-import statistics
+import abc
+import logging
 
-from pygame.display import set_caption
+import numpy as np
 import cost
 
 from cost import hM, mM, BM, AM, DM
 
+# ==========================================
+#               AGENT PROTOCOL
+# ==========================================
+
+class Agent(abc.ABC):
+    """
+    Common base of the AI agents.
+
+    An agent runs a single session when `n_sessions` is None, taking and returning plain
+    numbers, or `n_sessions` independent sessions at once, taking and returning arrays of
+    shape (n_sessions,). The same code serves the live game and offline batch evaluation.
+
+    Each frame the game calls `get_action` followed by `store_frame`, or `step` for both.
+    Trial statistics are kept as running sums, so memory per trial is constant.
+    Debug output goes through `logger` (the "experiments" logger by default) and is only
+    formatted when the logger has the level enabled.
+    """
+    __slots__ = ("n_sessions", "logger", "_debug")
+
+    def __init__(self, n_sessions=None, logger=None):
+        """
+        Args:
+          n_sessions: number of sessions stepped together, None for a single session
+          logger: `logging.Logger` for debug output
+        """
+        self.n_sessions = n_sessions
+        self.logger = logger or logging.getLogger("experiments")
+        # checked once so the per-frame path never touches the logging machinery
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)
+
+    def _full(self, value):
+        """
+        Returns per-session state initialized to `value`
+        """
+        if self.n_sessions is None:
+            return float(value)
+        return np.full(self.n_sessions, value, dtype=np.float64)
+
+    def _describe(self, value):
+        """
+        Formats per-session state for logging
+        """
+        if self.n_sessions is None:
+            return f"{float(value):.3f}"
+        return f"{np.mean(value):.3f} (mean of {self.n_sessions})"
+
+    @abc.abstractmethod
+    def get_action(self, human_h):
+        """
+        Returns the machine action for the human input `human_h`
+        """
+
+    def store_frame(self, h, m):
+        pass
+
+    def finish_trial(self):
+        pass
+
+    @property
+    def done(self):
+        """
+        True once the agent has finished learning and the round can end early
+        """
+        return False
+
+    def metadata(self):
+        """
+        Returns arrays describing the learning run, saved with the session data
+        """
+        return {}
+
+    def step(self, human_h):
+        """
+        Advances every session by one frame
+
+        Args:
+          human_h: human input, a number or an array of shape (n_sessions,)
+        Returns:
+          the machine action
+        """
+        m = self.get_action(human_h)
+        self.store_frame(human_h, m)
+        return m
+
+class TrialAgent(Agent):
+    """
+    Base of the agents that learn from pairs of trials of `mini_round_frames` frames:
+    a nominal trial followed by a perturbed one.
+
+    By default the trial statistics are running sums. An agent playing into a
+    `data.DataBase` can read them from the recorded frames instead, see `use_buffer`.
+
+    Every update of `L_M` is kept in `L_M_history`, with the quantity it was computed
+    from in `estimate_history`. With a `convergence` test, e.g. `RelativeChange`, the
+    agent reports `done` once `L_M` has settled, at the end of a trial pair, and the game
+    ends the round early. In batched mode the round is done once every session is.
+    """
+    __slots__ = ("mini_round_frames", "is_perturbed", "sum_h", "sum_m", "n_frames", "buffer",
+                 "convergence", "min_updates", "L_M_history", "estimate_history", "converged_update")
+
+    def __init__(self, mini_round_frames, n_sessions=None, logger=None, convergence=None, min_updates=3):
+        """
+        Args:
+          mini_round_frames: frames per trial
+          n_sessions: number of sessions stepped together, None for a single session
+          logger: `logging.Logger` for debug output
+          convergence: convergence test called as `convergence(L_M_history, estimate_history)`,
+            None to always play the full round
+          min_updates: number of updates of `L_M` before the test is run
+        """
+        super().__init__(n_sessions, logger)
+        self.mini_round_frames = mini_round_frames
+        self.is_perturbed = False
+        # running sums of the current trial, all sessions share trial boundaries
+        self.sum_h = self._full(0.0)
+        self.sum_m = self._full(0.0)
+        self.n_frames = 0
+        self.buffer = None
+        self.convergence = convergence
+        self.min_updates = min_updates
+        self.L_M_history = []
+        self.estimate_history = []
+        # number of updates after which each session converged, NaN while learning
+        self.converged_update = self._full(np.nan)
+
+    def use_buffer(self, database):
+        """
+        Computes the trial means from the frames recorded in `database` instead of
+        keeping running sums, nothing is copied per frame.
+
+        The last frame of a trial has to be in the database when the trial ends, so
+        `store_frame` must be called after `database.append`, not through `step`.
+        Single session agents only.
+
+        Args:
+          database: `data.DataBase` the game appends every frame to
+        """
+        if self.n_sessions is not None:
+            raise ValueError("use_buffer needs a single session agent")
+        self.buffer = database
+
+    def store_frame(self, h, m):
+        if self.buffer is None:
+            self.sum_h = self.sum_h + h
+            self.sum_m = self.sum_m + m
+        self.n_frames += 1
+        if self.n_frames >= self.mini_round_frames:
+            self.finish_trial()
+
+    def _trial_means(self):
+        """
+        Returns the mean h and m of the trial that just ended and starts a new trial
+        """
+        n = max(self.n_frames, 1)
+        if self.buffer is not None:
+            trial = self.buffer.window(-n)
+            avg_h = float(np.mean(trial["human_inputs"], dtype=np.float64))
+            avg_m = float(np.mean(trial["machine_inputs"], dtype=np.float64))
+        else:
+            avg_h, avg_m = self.sum_h / n, self.sum_m / n
+        self.sum_h = self._full(0.0)
+        self.sum_m = self._full(0.0)
+        self.n_frames = 0
+        return avg_h, avg_m
+
+    def _record_update(self, estimate, tag):
+        """
+        Records an update of `L_M` and runs the convergence test
+        """
+        self.L_M_history.append(self.L_M)
+        self.estimate_history.append(estimate)
+        n_updates = len(self.L_M_history) - 1
+        if self.convergence is None or self.done or n_updates < self.min_updates:
+            return
+        passed = self.convergence(self.L_M_history, self.estimate_history)
+        converged = np.where(np.logical_and(passed, np.isnan(self.converged_update)), n_updates,
+                             self.converged_update)
+        self.converged_update = float(converged) if self.n_sessions is None else converged
+        if self.done:
+            self.logger.info(f"  -> [{tag}] CONVERGED: Policy Slope settled at {self._describe(self.L_M)} "
+                             f"after {n_updates} updates")
+
+    @property
+    def done(self):
+        return not np.isnan(self.converged_update).any()
+
+    def metadata(self):
+        return {
+            "L_M_history": np.array(self.L_M_history),
+            "estimate_history": np.array(self.estimate_history),
+            "converged_update": np.asarray(self.converged_update),
+        }
+
+# ==========================================
+#            CONVERGENCE TESTS
+# ==========================================
+
+class RelativeChange:
+    """
+    Converged once each of the last `window` updates changed `L_M` by less than
+    `tolerance` times max(1, |L_M|)
+    """
+    def __init__(self, window=3, tolerance=0.05):
+        self.window = window
+        self.tolerance = tolerance
+
+    def __call__(self, L_M_history, estimate_history):
+        if len(L_M_history) <= self.window:
+            return False
+        recent = np.asarray(L_M_history[-(self.window + 1):])
+        change = np.abs(np.diff(recent, axis=0))
+        return np.all(change <= self.tolerance * np.maximum(1.0, np.abs(recent[1:])), axis=0)
+
+class ConfidenceBound:
+    """
+    Converged once the last `window` values of `L_M` show no significant drift and the
+    `z` confidence interval of their mean is narrower than +/- `half_width`
+    """
+    def __init__(self, window=4, half_width=0.05, z=1.96):
+        self.window = window
+        self.half_width = half_width
+        self.z = z
+
+    def __call__(self, L_M_history, estimate_history):
+        if len(L_M_history) <= self.window:
+            return False
+        recent = np.asarray(L_M_history[-self.window:])
+        spread = self.z * np.std(recent, axis=0, ddof=1) / np.sqrt(self.window)
+        steps = np.diff(np.asarray(L_M_history[-(self.window + 1):]), axis=0)
+        drift = np.abs(np.mean(steps, axis=0))
+        drift_bound = self.z * np.std(steps, axis=0, ddof=1) / np.sqrt(self.window)
+        return (spread <= self.half_width) & (drift <= np.maximum(drift_bound, 1e-12))
+
+def _safe_denominator(x):
+    """
+    Replaces denominators too close to 0 by 1e-9
+    """
+    return np.where(np.abs(x) < 1e-9, 1e-9, x) if np.ndim(x) else (1e-9 if abs(x) < 1e-9 else x)
+
 # ==========================================
 #               AI AGENT CLASSES
 # ==========================================
 
-class AI_Exp1:
+class AI_Exp1(Agent):
     """
     Experiment 1: Gradient Descent in Action Space.
     Updates m continuously every frame based on gradient.
     """
-    def __init__(self, alpha=0.3):
-        self.m = -0.2  # Start near Nash
+    __slots__ = ("m", "alpha", "frame_count")
+
+    def __init__(self, alpha=0.3, n_sessions=None, logger=None):
+        super().__init__(n_sessions, logger)
+        self.m = self._full(-0.2)  # Start near Nash
         self.alpha = alpha
-        # DEBUG: Counter to print info every second
+        # DEBUG: Counter to log info every half second
         self.frame_count = 0
 
     def get_action(self, human_h):
         # Calculate gradient d(c_M)/dm
         grad = cost.get_machine_gradient(human_h, self.m)
-        
+
         # Update State: m = m - alpha * grad
-        self.m = self.m - (self.alpha * grad)
-        
+        m = self.m - (self.alpha * grad)
+
         # Clamp to screen bounds [-1, 1]
-        self.m = max(-1.0, min(1.0, self.m))
-        
-        # --- DEBUG PRINT ---
+        if self.n_sessions is None:
+            self.m = max(-1.0, min(1.0, float(m)))
+        else:
+            self.m = np.clip(m, -1.0, 1.0)
+
+        # --- DEBUG LOG ---
         self.frame_count += 1
-        # Print every 30 frames (0.5 seconds)
-        if self.frame_count % 30 == 0:
-            print(f"[Exp1] Human: {human_h:.2f} | Machine Reacting: {self.m:.2f}")
-            
-        return self.m
+        # Log every 30 frames (0.5 seconds)
+        if self._debug and self.frame_count % 30 == 0:
+            self.logger.debug(f"[Exp1] Human: {self._describe(human_h)} | Machine Reacting: {self._describe(self.m)}")
 
-    def finish_trial(self):
-        pass 
+        return self.m
 
-class AI_Exp2:
+class AI_Exp2(TrialAgent):
     """
     Experiment 2: Conjectural Variation.
     """
-    def __init__(self, mini_round_frames):
+    __slots__ = ("L_M", "delta", "prev_avg_h", "prev_avg_m")
+
+    def __init__(self, mini_round_frames, delta=0.05, n_sessions=None, logger=None, convergence=None,
+                 min_updates=3):
+        super().__init__(mini_round_frames, n_sessions, logger, convergence, min_updates)
         # Initial Policy Slope: Nash Best Response
-        self.mini_round_frames = mini_round_frames
-        self.L_M = -cost.BM / cost.AM 
-        self.delta = 0.05 
-        self.is_perturbed = False 
-        
-        self.history_h = []
-        self.history_m = []
-        self.prev_avg_h = 0.0
-        self.prev_avg_m = 0.0
+        self.L_M = self._full(-cost.BM / cost.AM)
+        self.delta = delta
+        self.prev_avg_h = self._full(0.0)
+        self.prev_avg_m = self._full(0.0)
+        self.L_M_history.append(self.L_M)
+        # estimates: the conjectured human slope L_H
+        self.estimate_history.append(self._full(np.nan))
 
     def get_action(self, human_h):
         d = self.delta if self.is_perturbed else 0.0
         return self.L_M * (human_h - cost.hM) + cost.mM + d
 
-    def store_frame(self, h, m):
-        self.history_h.append(h)
-        self.history_m.append(m)
-        if len(self.history_h) >= self.mini_round_frames:
-            self.finish_trial()
-
     def finish_trial(self):
-        avg_h = statistics.mean(self.history_h) if self.history_h else 0
-        avg_m = statistics.mean(self.history_m) if self.history_m else 0
-        self.history_h, self.history_m = [], [] 
+        avg_h, avg_m = self._trial_means()
 
         if not self.is_perturbed:
             self.prev_avg_h = avg_h
             self.prev_avg_m = avg_m
             self.is_perturbed = True
-            print(f"  -> [Exp2] Trial A (Nominal) Done.")
+            self.logger.info("  -> [Exp2] Trial A (Nominal) Done.")
         else:
             self.is_perturbed = False
-            
-            denom = (avg_m - self.prev_avg_m)
-            if abs(denom) < 1e-9: denom = 1e-9
+
+            denom = _safe_denominator(avg_m - self.prev_avg_m)
             L_H = (avg_h - self.prev_avg_h) / denom
 
-            denom_pol = (cost.AM + L_H * cost.BM)
-            if abs(denom_pol) < 1e-9: denom_pol = 1e-9
+            denom_pol = _safe_denominator(cost.AM + L_H * cost.BM)
             self.L_M = -(cost.BM + L_H * cost.DM) / denom_pol
-            
-            # DEBUG PRINT
-            print(f"  -> [Exp2] LEARNING: Updated Policy Slope to: {self.L_M:.3f}")
 
-class AI_Exp3:
+            self.logger.info(f"  -> [Exp2] LEARNING: Updated Policy Slope to: {self._describe(self.L_M)}")
+            self._record_update(L_H, "Exp2")
+
+class AI_Exp3(TrialAgent):
     """
     Experiment 3: Policy Gradient.
+
+    The gradient of the machine cost with respect to L_M is estimated once per trial pair
+    by one of `ESTIMATORS`:
+
+      one_sided: a nominal trial at L_M and one at L_M + Delta, the difference of the
+        costs of the trial means over Delta
+      antithetic: trials at L_M - Delta and L_M + Delta. The central difference has no
+        first order bias from the curvature of the cost
+      spsa: antithetic with a random sign per session and pair, as in SPSA, so a human
+        drifting during the pair averages out instead of biasing every estimate the same
+        way. Delta shrinks as Delta / (k + 1) ** 0.101 with the update k
+      regression: least squares slope of the cost on the slope played, over the blocks
+        of the last `window` trials instead of the two trial means
+
+    Every estimate comes with an estimate of its variance, kept in `variance_history`,
+    from the spread of the cost over `blocks` blocks of each trial. Blocks rather than
+    single frames, since neighbouring frames are strongly correlated. The step size
+    follows `schedule`, by default the one `ESTIMATORS` lists for the estimator.
+
+    The estimators need different step sizes. The two sided ones see a smaller
+    difference per pair and their schedules shrink the step, at the one sided gamma of
+    1.0 none of them converges. Unless given, `gamma` and `max_change` are taken from
+    `ESTIMATOR_STEPS`.
     """
-    def __init__(self, mini_round_frames, gamma=2.0):
-        self.mini_round_frames = mini_round_frames
-        self.L_M = -cost.BM / cost.AM 
-        self.Delta = 0.05  
+    __slots__ = ("L_M", "Delta", "gamma", "cost_trial_1", "estimator", "schedule", "blocks", "window",
+                 "max_change", "rng", "offset", "sign", "trials", "block_ends", "next_block_end", "block_h",
+                 "block_m", "trial_blocks", "variance_history")
+
+    def __init__(self, mini_round_frames, gamma=None, Delta=0.05, n_sessions=None, logger=None,
+                 convergence=None, min_updates=3, estimator="one_sided", schedule=None, blocks=6,
+                 window=4, max_change=None, seed=None):
+        """
+        Args:
+          mini_round_frames: frames per trial
+          gamma: step size, the starting value of the schedule. None for the estimator's
+            default, see `ESTIMATOR_STEPS`
+          Delta: size of the slope perturbation
+          n_sessions: number of sessions stepped together, None for a single session
+          logger: `logging.Logger` for debug output
+          convergence: convergence test, see `TrialAgent`
+          min_updates: number of updates of `L_M` before the test is run
+          estimator: name of the gradient estimator, a key of `ESTIMATORS`
+          schedule: step size schedule called as `schedule(update, gradient, variance)`,
+            None for the default of the estimator
+          blocks: number of blocks per trial for the variance estimates
+          window: number of trials the regression estimator fits, at least 2
+          max_change: largest change of L_M per update, None for the estimator's default,
+            `math.inf` for no limit. Keeps a single noisy estimate from throwing L_M far
+            out, where the human may not settle
+          seed: seed for the random signs of the spsa estimator
+        """
+        if estimator not in ESTIMATORS:
+            raise ValueError(f"Unknown estimator {estimator}, expected one of {', '.join(ESTIMATORS)}")
+        super().__init__(mini_round_frames, n_sessions, logger, convergence, min_updates)
+        default_gamma, default_max_change = ESTIMATOR_STEPS[estimator]
+        gamma = default_gamma if gamma is None else gamma
+        max_change = default_max_change if max_change is None else max_change
+        self.L_M = self._full(-cost.BM / cost.AM)
+        self.Delta = Delta
         self.gamma = gamma
-        self.is_perturbed = False
-        
-        self.history_h = []
-        self.history_m = []
-        self.cost_trial_1 = 0.0
+        self.cost_trial_1 = self._full(0.0)
+        self.estimator = estimator
+        self.schedule = schedule if schedule is not None else ESTIMATORS[estimator](gamma)
+        self.blocks = max(2, min(blocks, mini_round_frames))
+        self.window = max(2, window)
+        self.max_change = max_change
+        self.rng = np.random.default_rng(seed)
+        self.sign = self._full(1.0)
+        # (slope, cost of the trial means, block costs) of the trials the next estimate uses
+        self.trials = []
+        # frame count at the end of each block, the trial sums where the current block
+        # started and the block costs of the current trial
+        self.block_ends = [round(mini_round_frames * (i + 1) / self.blocks) for i in range(self.blocks)]
+        self.next_block_end = self.block_ends[0]
+        self.block_h = self._full(0.0)
+        self.block_m = self._full(0.0)
+        self.trial_blocks = []
+        self.offset = self._perturbation(first=True)
+        self.L_M_history.append(self.L_M)
+        # estimates: the gradient of the machine cost with respect to L_M
+        self.estimate_history.append(self._full(np.nan))
+        self.variance_history = [self._full(np.nan)]
 
     def get_action(self, human_h):
-        D = self.Delta if self.is_perturbed else 0.0
-        slope = self.L_M + D
+        slope = self.L_M + self.offset
         raw_m = slope * (human_h - cost.hM) + cost.mM
         return raw_m
-    
+
     def store_frame(self, h, m):
-        self.history_h.append(h)
-        self.history_m.append(m)
-        if len(self.history_h) >= self.mini_round_frames:
-            self.finish_trial()
-            
-    def finish_trial(self):
-        avg_h = statistics.mean(self.history_h) if self.history_h else 0
-        avg_m = statistics.mean(self.history_m) if self.history_m else 0
+        if self.n_frames + 1 == self.next_block_end and self.buffer is None:
+            self._end_block(self.sum_h + h, self.sum_m + m)
+        super().store_frame(h, m)
+
+    def _end_block(self, sum_h, sum_m):
+        """
+        Records the cost of the means of the block ending at this frame, from the running
+        sums of the trial so the frame loop keeps no extra sums
+        """
+        i = len(self.trial_blocks)
+        size = self.block_ends[i] - (self.block_ends[i - 1] if i else 0)
+        self.trial_blocks.append(cost.get_machine_cost((sum_h - self.block_h) / size,
+                                                       (sum_m - self.block_m) / size))
+        self.block_h, self.block_m = sum_h, sum_m
+        self.next_block_end = self.block_ends[i + 1] if i + 1 < self.blocks else 0
+
+    def _perturbation(self, first):
+        """
+        Returns the slope offset of the first or second trial of the current pair
+        """
+        k = max(len(self.L_M_history) - 1, 0)
+        if self.estimator == "one_sided":
+            return 0.0 if first else self.Delta
+        if self.estimator == "spsa":
+            if first:
+                self.sign = self._full(1.0) * self.rng.choice((-1.0, 1.0), size=self.n_sessions)
+            delta = self.Delta / (k + 1) ** 0.101
+            return -self.sign * delta if first else self.sign * delta
+        return -self.Delta if first else self.Delta
+
+    def _block_costs(self):
+        """
+        Returns the costs of the block means of the trial that just ended, shape
+        (blocks,) or (blocks, n_sessions)
+        """
+        if self.buffer is not None:
+            trial = self.buffer.window(-max(self.n_frames, 1))
+            starts = [0] + self.block_ends[:-1]
+            return np.array([cost.get_machine_cost(
+                np.mean(trial["human_inputs"][a:b], dtype=np.float64),
+                np.mean(trial["machine_inputs"][a:b], dtype=np.float64)) for a, b in zip(starts, self.block_ends)])
+        blocks = np.array(self.trial_blocks)
+        self.trial_blocks = []
+        self.block_h = self._full(0.0)
+        self.block_m = self._full(0.0)
+        self.next_block_end = self.block_ends[0]
+        return blocks
+
+    def _difference_estimate(self, curr_cost, blocks):
+        """
+        Finite difference gradient of the trial pair and its variance
+        """
+        (slope_1, cost_1, blocks_1), slope_2 = self.trials[-1], self.L_M + self.offset
+        scale = _safe_denominator(slope_2 - slope_1)
+        gradient = (curr_cost - cost_1) / scale
+        variance = (np.var(blocks_1, axis=0, ddof=1) + np.var(blocks, axis=0, ddof=1)) / self.blocks / scale ** 2
+        return gradient, variance
+
+    def _regression_estimate(self, blocks):
+        """
+        Least squares slope of the block costs on the slope played over the last `window`
+        trials, and its variance
+        """
+        trials = self.trials[-(self.window - 1):] + [(self.L_M + self.offset, None, blocks)]
+        x = np.concatenate([np.broadcast_to(slope, np.shape(b)) for slope, _, b in trials])
+        y = np.concatenate([b for _, _, b in trials])
+        dx = x - np.mean(x, axis=0)
+        dy = y - np.mean(y, axis=0)
+        sxx = _safe_denominator(np.sum(dx * dx, axis=0))
+        gradient = np.sum(dx * dy, axis=0) / sxx
+        residual = dy - gradient * dx
+        variance = np.sum(residual * residual, axis=0) / (len(y) - 2) / sxx
+        if self.n_sessions is None:
+            return float(gradient), float(variance)
+        return gradient, variance
 
-        self.history_h, self.history_m = [], []
+    def finish_trial(self):
+        blocks = self._block_costs()
+        avg_h, avg_m = self._trial_means()
 
         curr_cost = cost.get_machine_cost(avg_h, avg_m)
 
         if not self.is_perturbed:
             self.cost_trial_1 = curr_cost
+            self.trials = self.trials[-(self.window - 1):] + [(self.L_M + self.offset, curr_cost, blocks)]
             self.is_perturbed = True
-            print(f"  -> [Exp3] Trial A Cost: {curr_cost:.4f}")
+            self.offset = self._perturbation(first=False)
+            self.logger.info(f"  -> [Exp3] Trial A Cost: {self._describe(curr_cost)}")
         else:
             self.is_perturbed = False
-            gradient = (curr_cost - self.cost_trial_1) / self.Delta
-            self.L_M = self.L_M - (self.gamma * gradient)
-            
-            # DEBUG PRINT
-            print(f"  -> [Exp3] LEARNING: Updated Policy Slope to: {self.L_M:.3f}")
+            if self.estimator == "regression":
+                gradient, variance = self._regression_estimate(blocks)
+            else:
+                gradient, variance = self._difference_estimate(curr_cost, blocks)
+            self.trials.append((self.L_M + self.offset, curr_cost, blocks))
+            step = self.schedule(len(self.L_M_history) - 1, gradient, variance)
+            change = step * gradient
+            if self.max_change is not None:
+                change = np.clip(change, -self.max_change, self.max_change)
+            self.L_M = self.L_M - change
+            self.variance_history.append(variance)
+
+            self.logger.info(f"  -> [Exp3] LEARNING: Updated Policy Slope to: {self._describe(self.L_M)} "
+                             f"(gradient std {self._describe(np.sqrt(variance))})")
+            self._record_update(gradient, "Exp3")
+            self.offset = self._perturbation(first=True)
+
+    def metadata(self):
+        return dict(super().metadata(), variance_history=np.array(self.variance_history))
+
+# ==========================================
+#          STEP SIZE SCHEDULES
+# ==========================================
+
+class ConstantStep:
+    """
+    Step size `gamma` at every update
+    """
+    def __init__(self, gamma):
+        self.gamma = gamma
+
+    def __call__(self, update, gradient, variance):
+        return self.gamma
+
+class DecayingStep:
+    """
+    Step size gamma * ((1 + stability) / (update + 1 + stability)) ** decay, the gain
+    sequence of SPSA. Starts at `gamma` and decays so the noise of late estimates
+    averages out instead of moving `L_M` around the optimum
+    """
+    def __init__(self, gamma, decay=0.602, stability=1.0):
+        self.gamma = gamma
+        self.decay = decay
+        self.stability = stability
+
+    def __call__(self, update, gradient, variance):
+        return self.gamma * ((1.0 + self.stability) / (update + 1.0 + self.stability)) ** self.decay
+
+class ShrinkageStep:
+    """
+    Step size gamma * g^2 / (g^2 + variance) for the gradient estimate g: full steps on
+    estimates well above their noise, shrunk towards 0 on estimates that are mostly noise
+    """
+    def __init__(self, gamma):
+        self.gamma = gamma
+
+    def __call__(self, update, gradient, variance):
+        g2 = np.square(gradient)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            shrink = np.where(np.isfinite(variance), g2 / (g2 + variance), 1.0)
+        shrink = np.nan_to_num(shrink, nan=1.0)
+        return self.gamma * (float(shrink) if np.ndim(shrink) == 0 else shrink)
+
+# Gradient estimators of `AI_Exp3` with the step size schedule each uses by default
+ESTIMATORS = {
+    "one_sided": ConstantStep,
+    "antithetic": DecayingStep,
+    "spsa": DecayingStep,
+    "regression": ShrinkageStep,
+}
+
+# Default (gamma, max_change) of each estimator, None for no limit. The best of a sweep
+# over gamma 1-30 and max_change 0.1-0.5 with the `sweep.py` defaults (10 trials of 180
+# frames, best responding humans), e.g. a final error of 0.29, 0.27 and 0.21 for the
+# two sided estimators against 0.36 for one_sided at its own default
+ESTIMATOR_STEPS = {
+    "one_sided": (1.0, None),
+    "antithetic": (10.0, 0.25),
+    "spsa": (10.0, 0.25),
+    "regression": (10.0, 0.25),
+}
+
+def make_agent(name, n_sessions=None, **params):
+    """
+    Creates an agent of this module by class name
+
+    Args:
+      name: class name, e.g. "AI_Exp3"
+      n_sessions: number of sessions stepped together, None for a single session
+      params: constructor arguments of the agent, e.g. mini_round_frames=180
+    """
+    agent_class = globals().get(name)
+    if not (isinstance(agent_class, type) and issubclass(agent_class, Agent)):
+        raise ValueError(f"Unknown agent {name}")
+    return agent_class(n_sessions=n_sessions, **params)
+
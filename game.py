@@ -1,90 +1,193 @@
+import logging
 import pygame
 import sys
-from data import DataBase
-from game_gui import draw_rect, get_scaled_mouse_pos, countdown
+import numpy as np
+from data import DataBase, recover_partial_rounds
+from timing import FrameTimer
+from game_clock import GameClock
+from mouse_input import MouseSampler
+from game_gui import draw_rect, RectRenderer, DisplaySession
 from cost import get_human_cost, get_machine_cost
-from experiments import AI_Exp1, AI_Exp2, AI_Exp3
+from experiments import AI_Exp1, AI_Exp2, AI_Exp3, TrialAgent, RelativeChange
 
 def run_game():
     """
     Runs all rounds of the game with the specific logic for each experiment.
     """
-    # --- Experiment 1: Gradient Descent in Action Space ---
-    print("Starting Experiment 1...")
-    ai_1 = AI_Exp1(alpha=0.3)
-    # This runs one long round (40s)
-    run_round(1, 600, ai_1, "Exp1")
+    # Save anything a previous crashed run left behind, marked as incomplete
+    recovered = recover_partial_rounds()
+    if recovered:
+        print(f"Recovered {recovered} incomplete rounds from a previous run")
 
-
-    MINI_ROUND_FRAMES = 3 * 60
+    # Round lengths are in seconds, each second has CONTROL_RATE control steps
+    CONTROL_RATE = 60
+    EXP1_SECONDS = 10
+    MINI_ROUND_SECONDS = 3
     MINI_ROUNDS = 10
-    # --- Experiment 2: Conjectural Variations (Policy Space) ---
-    print("Starting Experiment 2...")
-    ai_2 = AI_Exp2(MINI_ROUND_FRAMES)
-    # This runs 10 PAIRS (20 trials total)
-    run_round(2, MINI_ROUND_FRAMES * MINI_ROUNDS * 2, ai_2, "Exp2")
-        
-    # --- Experiment 3: Policy Gradient (Policy Space) ---
-    print("Starting Experiment 3...")
-    ai_3 = AI_Exp3(MINI_ROUND_FRAMES, gamma=1.0)
-    run_round(3, MINI_ROUND_FRAMES * MINI_ROUNDS * 2, ai_3, "Exp3")
+    MINI_ROUND_FRAMES = round(MINI_ROUND_SECONDS * CONTROL_RATE)
+
+    # One window for all rounds, so there is no mode switch between them
+    with DisplaySession() as session:
+        # --- Experiment 1: Gradient Descent in Action Space ---
+        print("Starting Experiment 1...")
+        ai_1 = AI_Exp1(alpha=0.3)
+        # This runs one long round (10s)
+        run_round(1, EXP1_SECONDS, ai_1, "Exp1", control_rate=CONTROL_RATE, session=session)
+
+
+        # --- Experiment 2: Conjectural Variations (Policy Space) ---
+        print("Starting Experiment 2...")
+        # Ends the round once L_M has settled
+        ai_2 = AI_Exp2(MINI_ROUND_FRAMES, convergence=RelativeChange(window=3, tolerance=0.05))
+        # This runs up to 10 PAIRS (20 trials total)
+        run_round(2, MINI_ROUND_SECONDS * MINI_ROUNDS * 2, ai_2, "Exp2", control_rate=CONTROL_RATE,
+                  session=session)
+
+        # --- Experiment 3: Policy Gradient (Policy Space) ---
+        print("Starting Experiment 3...")
+        ai_3 = AI_Exp3(MINI_ROUND_FRAMES, gamma=1.0, convergence=RelativeChange(window=3, tolerance=0.05))
+        run_round(3, MINI_ROUND_SECONDS * MINI_ROUNDS * 2, ai_3, "Exp3", control_rate=CONTROL_RATE,
+                  session=session)
     
-def run_round(round_num, duration, ai_agent, log_label=""):
+def run_round(round_num, duration, ai_agent, log_label="", store=None, render_mode="dirty", control_rate=60,
+              render_rate=None, input_smoothing=None, session=None):
     """
     Starts the main game loop, game will not exit until the program finishes, the window is closed
     or 'esc' is pressed
 
+    The round runs on a fixed-timestep `GameClock`: every control step (input sample,
+    agent, costs, saved frame) stands for exactly `1 / control_rate` seconds, and steps
+    that fall behind while rendering lags are caught up with the input as it was when
+    they were due. A round therefore always has `duration * control_rate` samples and
+    lasts `duration` seconds on any machine. An agent that converged (`ai_agent.done`) ends
+    the round early, at the end of the step it converged in.
+
     Args:
       round_num: The round number to display between rounds
-      duration: length of the round in frames (approx duration / 60 seconds)
+      duration: length of the round in seconds
+      store: optional `store.SessionStore` to save the round to instead of a new .npz file
+      render_mode: "dirty" only redraws the part of the screen that changed, "full" redraws
+        the whole screen every frame
+      control_rate: control steps per second
+      render_rate: largest number of rendered frames per second, `None` renders after
+        every batch of control steps
+      input_smoothing: time constant in seconds of the filter applied to the mouse input,
+        `None` gives the agent the latest mouse position
+      session: `DisplaySession` to draw to. If `None` the round opens its own window and
+        closes it at the end
     """
-    pygame.display.init()
-    pygame.font.init()
-    clock = pygame.time.Clock()
+    own_session = session is None
+    if own_session:
+        session = DisplaySession()
+    canvas = session.canvas
     BACKGROUND_COLOR = (200, 200, 200)
-    canvas = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
-    pygame.display.set_caption("Keep the Rectangle Low")
-    exit = False
+    n_steps = round(duration * control_rate)
 
-    database = DataBase(duration)
-    
-    FPS = 60
-    countdown(canvas, clock, round_num)
-    # force the correct number of collection points, even if it runs slower
-    for frame in range(duration):
-        clock.tick(FPS)
-
-        # 1. Get Human Input
-        h_val = get_scaled_mouse_pos(canvas)
-        
-        # 2. Get Machine Action from the Agent
-        m_val = ai_agent.get_action(h_val)
-        
-        # 3. Allow AI to store data (needed for Exp 2 & 3 learning)
-        if hasattr(ai_agent, "store_frame"):
+    session.countdown(round_num)
+    # streams the round to disk in the background while it is played. Created after the
+    # countdown, leaving during the countdown saves nothing
+    database = DataBase(n_steps, round_num=f"{round_num}_{log_label}")
+    # Exp 2 & 3 read their trial statistics straight from the recorded frames
+    if isinstance(ai_agent, TrialAgent):
+        ai_agent.use_buffer(database)
+
+    # records how long each control step, and each part of it, really took
+    timer = FrameTimer(n_steps, control_rate)
+    renderer = RectRenderer(canvas, BACKGROUND_COLOR) if render_mode == "dirty" else None
+    # reads every mouse motion event, independent of the frame rate
+    sampler = MouseSampler(canvas, smoothing=input_smoothing)
+    clock = GameClock(n_steps, control_rate, render_rate)
+    clock.start()
+    c_h = 0.0
+    stopped_early = False
+    while not clock.done and not stopped_early:
+        # keep sampling the mouse instead of sleeping until the next control step
+        events = sampler.sample_until(clock.next_step_time())
+
+        for step_time in clock.due_steps():
+            timer.start_frame()
+
+            # 1. Get Human Input, the freshest (or filtered) mouse position. A step that
+            # is catching up gets the input of the time it was due
+            h_val = sampler.value() if clock.due_left == 0 else sampler.value_at(step_time)
+            timer.mark("input")
+
+            # 2. Get Machine Action from the Agent
+            m_val = ai_agent.get_action(h_val)
+            timer.mark("agent")
+
+            # 4. Calculate Costs
+            c_h = get_human_cost(h_val, m_val)
+            c_m = get_machine_cost(h_val, m_val)
+            timer.mark("cost")
+
+            # 5. Save Real Data
+            database.append(h_val, m_val, c_h, c_m)
+            timer.mark("database")
+
+            # 3. Allow AI to store data (needed for Exp 2 & 3 learning), after the frame is saved
             ai_agent.store_frame(h_val, m_val)
+            timer.mark("agent")
 
-        # 4. Calculate Costs
-        c_h = get_human_cost(h_val, m_val)
-        c_m = get_machine_cost(h_val, m_val)
-        
-        # 5. Save Real Data
-        database.append(h_val, m_val, c_h, c_m)
-                
-        canvas.fill(BACKGROUND_COLOR)
-        draw_rect(canvas, c_h)
-        
-        for event in pygame.event.get():
+            if ai_agent.done:
+                stopped_early = True
+                break
+
+        for event in events:
             if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
+                _abort_round(database, timer, sampler, clock, ai_agent, n_steps, log_label)
             if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                pygame.quit()
-                sys.exit()
-        pygame.display.update()
+                _abort_round(database, timer, sampler, clock, ai_agent, n_steps, log_label)
+        timer.mark("events")
+
+        if not clock.render_due():
+            continue
+        if renderer is not None:
+            dirty = renderer.draw(c_h)
+        else:
+            canvas.fill(BACKGROUND_COLOR)
+            draw_rect(canvas, c_h)
+        timer.mark("draw")
+        if renderer is None:
+            pygame.display.update()
+        elif dirty is not None:
+            pygame.display.update(dirty)
+        timer.mark("display")
+
+    if own_session:
+        session.close()
+    timer.print_summary(log_label)
+    summary = clock.summary()
+    print(f"     {summary['steps']} control steps in {summary['elapsed_s']:.2f} s "
+          f"({duration:.2f} s planned), {summary['caught_up_steps']} caught up, {summary['renders']} renders")
+    if stopped_early:
+        print(f"     [{log_label}] agent converged, round ended after {database.current_frame} of {n_steps} steps")
+    _attach_round(database, timer, sampler, clock, ai_agent, stopped_early, n_steps)
+    database.write(f"{round_num}_{log_label}", store=store)
 
+def _attach_round(database, timer, sampler, clock, ai_agent, stopped_early, n_steps):
+    """
+    Attaches what is saved with every round besides its frames: the timings, the input
+    stream, the time of every step, whether the agent ended the round and the agent's
+    learning history
+    """
+    database.attach(timer.arrays())
+    database.attach(sampler.arrays())
+    database.attach({"step_times": clock.step_time(np.arange(database.current_frame))})
+    database.attach({"stopped_early": np.bool_(stopped_early), "planned_steps": np.int64(n_steps)})
+    database.attach(ai_agent.metadata())
+
+def _abort_round(database, timer, sampler, clock, ai_agent, n_steps, log_label):
+    """
+    Saves the incomplete round with the same extras as a finished one and exits the game
+    """
+    timer.print_summary(log_label)
+    _attach_round(database, timer, sampler, clock, ai_agent, False, n_steps)
+    database.close()
     pygame.quit()
-    database.write(f"{round_num}_{log_label}")
+    sys.exit()
 
 if __name__ == "__main__":
+    # show the agents' learning updates, use logging.DEBUG for per-frame Exp1 output
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     run_game()
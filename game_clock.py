@@ -0,0 +1,122 @@
+import time
+
+class GameClock:
+    """
+    Fixed-timestep game clock.
+
+    Game time advances in control steps of exactly `1 / control_rate` seconds, no matter
+    how long a rendered frame takes. Real time elapsed since `start` goes into an
+    accumulator and every full step in it is a control step that is due. When rendering
+    or the machine lags, the steps that fell behind are caught up back to back before the
+    next render, so a round of `n_steps` steps always records exactly `n_steps` samples
+    and still lasts `n_steps / control_rate` seconds of real time. Usage:
+
+      clock.start()
+      while not clock.done:
+          wait_until(clock.next_step_time())
+          for step_time in clock.due_steps():
+              control_step(step_time)
+          if clock.render_due():
+              render()
+    """
+    def __init__(self, n_steps, control_rate=60, render_rate=None, max_catch_up=10,
+                 time_function=time.perf_counter):
+        """
+        Args:
+          n_steps: number of control steps of the round
+          control_rate: control steps per second
+          render_rate: largest number of rendered frames per second, `None` renders after
+            every batch of control steps
+          max_catch_up: most control steps run between two renders. Steps beyond that
+            stay due and run after the render, so a long stall cannot freeze the screen
+          time_function: clock in seconds, e.g. `time.perf_counter` or `loop.time`
+        """
+        self.n_steps = n_steps
+        self.control_rate = control_rate
+        self.dt = 1.0 / control_rate
+        self.render_interval = 1.0 / render_rate if render_rate else 0.0
+        self.max_catch_up = max_catch_up
+        self.time_function = time_function
+        self.start_time = None
+        self.steps = 0
+        self.accumulator = 0.0
+        self.caught_up_steps = 0
+        self.due_left = 0
+        self.renders = 0
+        self._next_render = 0.0
+        self._stepped = False
+
+    def start(self, now=None):
+        """
+        Starts the round, the first control step is due at once
+        """
+        self.start_time = self.time_function() if now is None else now
+        self.steps = 0
+        self.accumulator = self.dt
+        self.caught_up_steps = 0
+        self.due_left = 0
+        self.renders = 0
+        self._next_render = self.start_time
+        self._stepped = False
+
+    @property
+    def done(self):
+        return self.steps >= self.n_steps
+
+    def step_time(self, step):
+        """
+        Returns the time at which control step `step` is due
+        """
+        return self.start_time + step * self.dt
+
+    def next_step_time(self):
+        return self.step_time(self.steps)
+
+    def _advance(self, now):
+        # time since start not yet consumed by control steps, computed from the start
+        # time rather than summed per frame so rounding errors never accumulate
+        self.accumulator = now - self.start_time - (self.steps - 1) * self.dt
+
+    def due_steps(self, now=None):
+        """
+        Yields the scheduled time of every control step that is due, at most
+        `max_catch_up` of them, and counts each as done when it is yielded. While a step
+        runs `due_left` is the number of due steps after it, 0 for the newest one
+        """
+        self._advance(self.time_function() if now is None else now)
+        n_due = min(int(self.accumulator // self.dt), self.max_catch_up, self.n_steps - self.steps)
+        # steps are only counted once yielded, so breaking out of the loop leaves the
+        # steps that did not run due
+        for i in range(n_due):
+            step_time = self.step_time(self.steps)
+            self.steps += 1
+            self.accumulator -= self.dt
+            self._stepped = True
+            self.due_left = n_due - 1 - i
+            if self.due_left:
+                self.caught_up_steps += 1
+            yield step_time
+        self.due_left = 0
+
+    def render_due(self, now=None):
+        """
+        Returns True if a frame should be rendered now: a control step ran since the last
+        render and the render interval has passed
+        """
+        if not self._stepped:
+            return False
+        now = self.time_function() if now is None else now
+        if now < self._next_render:
+            return False
+        self._next_render = max(self._next_render + self.render_interval, now)
+        self._stepped = False
+        self.renders += 1
+        return True
+
+    def summary(self):
+        """
+        Returns the control steps, the steps that ran late to catch up, the renders and
+        the real duration of the round so far
+        """
+        return {"steps": self.steps, "caught_up_steps": self.caught_up_steps, "renders": self.renders,
+                "elapsed_s": self.time_function() - self.start_time if self.start_time is not None else 0.0}
@@ -1,6 +1,7 @@
 import sys
 import pygame
 import math
+from bisect import bisect_right
 def draw_rect(canvas, human_cost):
     """
     Draws a black rectangle centered on the screen, representing the human cost
@@ -9,16 +10,90 @@ def draw_rect(canvas, human_cost):
       canvas: pygame canvas to draw the rectangle to
       human_cost: the unscaled human cost, used to caluclate the rectangle height
     """
-    rect_width = canvas.get_rect().width * 0.1
-    rect_height = _get_human_display_value(human_cost, canvas.get_rect().height)
-    rect_pos_x = (canvas.get_rect().centerx) - (rect_width / 2)
-    rect_pos_y = canvas.get_rect().height - rect_height
+    canvas_rect = canvas.get_rect()
+    rect_width = canvas_rect.width * 0.1
+    rect_height = _get_human_display_value(human_cost, canvas_rect.height)
+    rect_pos_x = (canvas_rect.centerx) - (rect_width / 2)
+    rect_pos_y = canvas_rect.height - rect_height
     RECT_COLOR = (0, 0, 0)
     pygame.draw.rect(canvas,
                      RECT_COLOR,
                      (rect_pos_x, rect_pos_y, rect_width, rect_height)
                     )
 
+class RectRenderer:
+    """
+    Draws the cost rectangle by only redrawing the parts of the screen that changed.
+
+    The rectangle geometry is computed once and the cost to pixel height mapping is a
+    precomputed table of the cost at which each pixel row is reached, so a frame is a
+    binary search, one `fill` and a `display.update` of the strip between the old and the
+    new top edge of the rectangle instead of a full screen redraw.
+    """
+    def __init__(self, canvas, background_color=(200, 200, 200), rect_color=(0, 0, 0)):
+        """
+        Args:
+          canvas: pygame canvas to draw the rectangle to
+          background_color: color of the screen behind the rectangle
+          rect_color: color of the rectangle
+        """
+        self.canvas = canvas
+        self.background_color = background_color
+        self.rect_color = rect_color
+
+        canvas_rect = canvas.get_rect()
+        self.screen_height = canvas_rect.height
+        self.rect_width = int(canvas_rect.width * 0.1)
+        self.rect_pos_x = canvas_rect.centerx - self.rect_width // 2
+
+        # Inverse of `_get_human_display_value`: the cost at which the rectangle is
+        # `k` pixels high, for every k in [0, screen_height]
+        MAX = 596 / 375
+        self.thresholds = [MAX * (k / self.screen_height) ** 2 for k in range(self.screen_height + 1)]
+
+        self.previous_height = 0
+        canvas.fill(background_color)
+        pygame.display.flip()
+
+    def rect_height(self, human_cost):
+        """
+        Returns the rectangle height in pixels for `human_cost`
+        """
+        return max(bisect_right(self.thresholds, human_cost) - 1, 0)
+
+    def draw(self, human_cost):
+        """
+        Draws the rectangle for `human_cost`
+
+        Returns:
+          the changed area of the canvas to pass to `pygame.display.update`, or None if
+          nothing changed
+        """
+        height = self.rect_height(human_cost)
+        previous = self.previous_height
+        if height == previous:
+            return None
+        # only the strip between the old and the new top edge changes
+        top = self.screen_height - max(height, previous)
+        strip = pygame.Rect(self.rect_pos_x, top, self.rect_width, abs(height - previous))
+        self.canvas.fill(self.rect_color if height > previous else self.background_color, strip)
+        self.previous_height = height
+        return strip
+
+def get_display_flags():
+    """
+    Returns the flags for `pygame.display.set_mode`, asking for hardware acceleration and
+    double buffering unless running on a headless video driver.
+
+    Under pygame 2 these flags are hints, the display surface still supports updating
+    only parts of the screen, which `RectRenderer` relies on.
+    """
+    flags = pygame.FULLSCREEN
+    driver = pygame.display.get_driver() if pygame.display.get_init() else ""
+    if driver not in ("dummy", "offscreen"):
+        flags |= pygame.HWSURFACE | pygame.DOUBLEBUF
+    return flags
+
 def get_scaled_mouse_pos(canvas: pygame.Surface):
     """
     Gets mouse x position and scales it to be between -1.0 and 1.0
@@ -32,7 +107,7 @@ def get_scaled_mouse_pos(canvas: pygame.Surface):
     mouse_x, _ = pygame.mouse.get_pos()
     return (mouse_x / canvas.get_rect().centerx) - 1.0
 
-def countdown(screen, clock, round_num, duration=3):
+def countdown(screen, clock, round_num, duration=3, render=None):
     """
     Displays a `duration` second countdown on the screen. Also displays round number.
 
@@ -41,17 +116,24 @@ def countdown(screen, clock, round_num, duration=3):
       clock: clock used by main game
       round_num: the round number to be displayed
       duration: how many seconds the countdown should be
+      render: function returning the rendered surface of a text, e.g.
+        `DisplaySession.render_text`. Defaults to rendering with a new font
     """
-    font = pygame.font.Font(None, 100)
+    if render is None:
+        font = pygame.font.Font(None, 100)
+        render = lambda text: font.render(text, True, (255, 255, 255))
+    # a clock reused between rounds was last ticked long ago, restart it so the first
+    # number is shown for a full second
+    clock.tick()
     for tick in range(duration, 0, -1):
         
         screen.fill((0, 0, 0)) 
         
-        count_text = font.render(str(tick), True, (255, 255, 255))
+        count_text = render(str(tick))
         text_rect = count_text.get_rect(center=(screen.get_width() // 2, screen.get_height() // 2))
         screen.blit(count_text, text_rect)
 
-        round_text = font.render(f"Round {round_num}", True, (255, 255, 255))
+        round_text = render(f"Round {round_num}")
         center_x = screen.get_width() // 2
         center_y = screen.get_height() // 2
         
@@ -69,7 +151,56 @@ def countdown(screen, clock, round_num, duration=3):
                 sys.exit()
         # update once per second
         clock.tick(1)
-        
+
+class DisplaySession:
+    """
+    Owns the window, clock and fonts for a whole run of the game.
+
+    Creating the fullscreen window is a mode switch with a visible black screen on most
+    monitors, so it is done once and every round draws to the same window. Countdown
+    texts are rendered once and reused. Use as a context manager, or call `close`.
+    """
+    def __init__(self, caption="Keep the Rectangle Low", max_countdown=3, rounds=(1, 2, 3)):
+        """
+        Args:
+          caption: window title
+          max_countdown: largest countdown number to pre-render
+          rounds: round numbers whose "Round {n}" text is pre-rendered
+        """
+        pygame.display.init()
+        pygame.font.init()
+        self.clock = pygame.time.Clock()
+        self.canvas = pygame.display.set_mode((0, 0), get_display_flags())
+        pygame.display.set_caption(caption)
+        self.font = pygame.font.Font(None, 100)
+        self.texts = {}
+        for text in [str(n) for n in range(1, max_countdown + 1)] + [f"Round {n}" for n in rounds]:
+            self.render_text(text)
+
+    def render_text(self, text):
+        """
+        Returns the rendered surface of `text`, rendering it only the first time
+        """
+        surface = self.texts.get(text)
+        if surface is None:
+            surface = self.texts[text] = self.font.render(text, True, (255, 255, 255))
+        return surface
+
+    def countdown(self, round_num, duration=3):
+        """
+        Displays the countdown before a round, see `countdown`
+        """
+        countdown(self.canvas, self.clock, round_num, duration, self.render_text)
+
+    def close(self):
+        pygame.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 def _get_human_display_value(human_cost, screen_height):
     """
     Converts `human_cost` to appropriate display value based on the `screen height`
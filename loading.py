@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from store import MEMBER_PATTERN
+
+CACHE_DIRECTORY = ".viz_cache"
+
+# Arrays of a session file that the plots use
+SESSION_KEYS = ("human_inputs", "machine_inputs", "human_scores", "machine_scores")
+
+class SessionLoader:
+    """
+    Loads session `.npz` files for the plots in `visualize.py`.
+
+    Files are decompressed in a thread pool (zlib releases the GIL). Derived summaries
+    (medians, smoothed curves, density images, ...) are kept in an on-disk cache keyed by
+    each file's path, modification time and size, so re-running a plot with no new
+    sessions skips loading and computing altogether. The session arrays themselves are
+    not cached, a copy would take more disk than the compressed files it saves reading.
+    """
+    def __init__(self, data_root="data", cache_directory=CACHE_DIRECTORY, workers=None):
+        """
+        Args:
+          data_root: directory holding the `round_{n}_{label}` folders
+          cache_directory: directory of the cache, `None` disables caching
+          workers: number of loader threads, defaults to the ThreadPoolExecutor default
+        """
+        self.data_root = data_root
+        self.cache_directory = cache_directory
+        self.workers = workers
+        if cache_directory is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+
+    def files(self, round_num, label):
+        """
+        Returns the session files of one experiment, sorted for a stable order
+        """
+        return sorted(glob.glob(os.path.join(self.data_root, f"round_{round_num}_{label}", "*.npz")))
+
+    def _file_key(self, file_path):
+        stat = os.stat(file_path)
+        return f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+
+    def _read(self, file_path, keys):
+        with np.load(file_path) as data:
+            return {key: data[key] for key in keys if key in data.files}
+
+    def _cache_path(self, *parts):
+        digest = hashlib.sha1("\n".join(parts).encode()).hexdigest()
+        return os.path.join(self.cache_directory, f"{digest}.npz")
+
+    def load(self, files, keys=SESSION_KEYS):
+        """
+        Loads `files` in parallel
+
+        Args:
+          files: session file paths
+          keys: arrays to read from every file, keys a file does not have, e.g. the
+            agent metadata of older recordings, are left out of its dict
+        Returns:
+          list with a dict of arrays per file, in the order of `files`
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(lambda f: self._read(f, keys), files))
+
+    def iter_load(self, files, keys=SESSION_KEYS, chunk_size=1000):
+        """
+        Loads `files` in parallel, `chunk_size` files at a time, to bound memory
+
+        Yields:
+          lists of dicts of arrays, as returned by `load`
+        """
+        for start in range(0, len(files), chunk_size):
+            yield self.load(files[start:start + chunk_size], keys)
+
+    def summary(self, name, files, compute, keys=SESSION_KEYS, **params):
+        """
+        Returns a cached summary of `files`, computing it only if a file or a parameter changed
+
+        Args:
+          name: name of the summary, part of the cache key
+          files: session file paths
+          compute: function called as `compute(chunks, **params)` with the output of
+            `iter_load`, returning a dict of arrays
+          keys: arrays to read from every file
+          params: parameters of `compute`, part of the cache key
+        Returns:
+          the dict of arrays returned by `compute`
+        """
+        cache_path = None
+        if self.cache_directory:
+            cache_path = self._cache_path(name, json.dumps(params, sort_keys=True), *keys,
+                                          *(self._file_key(f) for f in files))
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as data:
+                    return {key: data[key] for key in data.files}
+        result = compute(self.iter_load(files, keys), **params)
+        if cache_path:
+            _save_atomic(cache_path, result)
+        return result
+
+class ArchiveLoader(SessionLoader):
+    """
+    `SessionLoader` reading the shipped `data.zip`/`data1.zip` archives without extracting them.
+
+    Opening the loader only reads the archives' central directories to index the session
+    members by round and experiment label. Members are decompressed lazily when loaded,
+    in parallel, with one open handle per archive and thread. Several archives are merged
+    into one dataset, a member is identified as `{archive}::{member name}`, so archives
+    sharing the `data/` prefix never collide. A session present in more than one archive
+    is only used once.
+    """
+    SEPARATOR = "::"
+
+    def __init__(self, archives, cache_directory=CACHE_DIRECTORY, workers=None):
+        """
+        Args:
+          archives: paths of the zip archives
+          cache_directory: directory of the cache, `None` disables caching
+          workers: number of loader threads, defaults to the ThreadPoolExecutor default
+        """
+        super().__init__(None, cache_directory, workers)
+        self.archives = [os.path.abspath(a) for a in archives]
+        self._local = threading.local()
+        # (round, label) -> member ids, member id -> ZipInfo
+        self.index = {}
+        self.members = {}
+        seen = set()
+        for archive in self.archives:
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    match = MEMBER_PATTERN.search(info.filename)
+                    if not match or match.group(3) in seen:
+                        continue
+                    seen.add(match.group(3))
+                    member = f"{archive}{self.SEPARATOR}{info.filename}"
+                    self.members[member] = info
+                    self.index.setdefault((int(match.group(1)), match.group(2) or ""), []).append(member)
+
+    def files(self, round_num, label):
+        return sorted(self.index.get((int(round_num), label), []))
+
+    def _file_key(self, member):
+        archive, _ = member.split(self.SEPARATOR, 1)
+        info = self.members[member]
+        return f"{super()._file_key(archive)}|{info.filename}|{info.CRC}"
+
+    def _archive(self, archive):
+        """
+        Returns this thread's open handle of `archive`, zipfile handles are not thread safe
+        """
+        handles = getattr(self._local, "handles", None)
+        if handles is None:
+            handles = self._local.handles = {}
+        if archive not in handles:
+            handles[archive] = zipfile.ZipFile(archive)
+        return handles[archive]
+
+    def _read(self, member, keys):
+        archive, name = member.split(self.SEPARATOR, 1)
+        raw = self._archive(archive).read(name)
+        with np.load(io.BytesIO(raw)) as data:
+            return {key: data[key] for key in keys if key in data.files}
+
+def _save_atomic(file_path, arrays):
+    """
+    Saves compressed, through a temporary file, so concurrent runs never read a
+    half-written cache entry
+    """
+    with open(file_path + ".tmp", "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(file_path + ".tmp", file_path)
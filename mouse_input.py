@@ -0,0 +1,131 @@
+import math
+import time
+import pygame
+import numpy as np
+
+class MouseSampler:
+    """
+    Reads the mouse from its `MOUSEMOTION` events instead of once per rendered frame.
+
+    Every motion event is kept, with its timestamp, in a growable buffer, so the full
+    input stream is available at the mouse's own rate. `sample_until` keeps reading
+    events while the frame loop would otherwise sleep, so the agent always gets the
+    freshest position (or an exponentially filtered one) at each control step.
+
+    pygame 2 events carry no timestamp. When an event has none, the events read in one
+    poll are spread evenly between the previous poll and the current one, which is exact
+    to within the polling interval of `sample_until`.
+    """
+    def __init__(self, canvas, smoothing=None, capacity=4096):
+        """
+        Args:
+          canvas: canvas the mouse is moving on
+          smoothing: time constant of the exponential filter in seconds, `None` to use
+            the latest position without filtering
+          capacity: initial number of samples in the buffer, it grows as needed
+        """
+        self.center_x = canvas.get_rect().centerx
+        self.smoothing = smoothing
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.samples = np.zeros(capacity, dtype=np.float64)
+        # value of the (filtered) input right after each sample, for `value_at`
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.n_samples = 0
+
+        self.last_poll = time.perf_counter()
+        self.latest = self._scale(pygame.mouse.get_pos()[0])
+        self.filtered = self.latest
+        self.initial = self.latest
+        self.last_time = self.last_poll
+
+    def _scale(self, mouse_x):
+        """
+        Scales a mouse x position to be between -1.0 and 1.0, like `get_scaled_mouse_pos`
+        """
+        return (mouse_x / self.center_x) - 1.0
+
+    def _record(self, timestamp, value):
+        if self.n_samples == len(self.samples):
+            self.timestamps = np.concatenate([self.timestamps, np.zeros_like(self.timestamps)])
+            self.samples = np.concatenate([self.samples, np.zeros_like(self.samples)])
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+
+        if self.smoothing:
+            alpha = 1.0 - math.exp(-max(timestamp - self.last_time, 0.0) / self.smoothing)
+            self.filtered += alpha * (value - self.filtered)
+        else:
+            self.filtered = value
+        self.latest = value
+        self.last_time = timestamp
+
+        self.timestamps[self.n_samples] = timestamp
+        self.samples[self.n_samples] = value
+        self.values[self.n_samples] = self.filtered
+        self.n_samples += 1
+
+    def poll(self):
+        """
+        Reads all pending events and records the mouse motion
+
+        Returns:
+          list of all events that are not mouse motion, for the caller to handle
+        """
+        now = time.perf_counter()
+        events = pygame.event.get()
+        motion = [e for e in events if e.type == pygame.MOUSEMOTION]
+        for i, event in enumerate(motion):
+            timestamp = getattr(event, "timestamp", None)
+            if timestamp is None:
+                timestamp = self.last_poll + (now - self.last_poll) * (i + 1) / len(motion)
+            else:
+                # SDL event timestamps are in milliseconds since pygame.init()
+                timestamp = now - (pygame.time.get_ticks() - timestamp) / 1000.0
+            self._record(timestamp, self._scale(event.pos[0]))
+        self.last_poll = now
+        return [e for e in events if e.type != pygame.MOUSEMOTION]
+
+    def sample_until(self, deadline, interval_ms=1):
+        """
+        Keeps polling the mouse until `deadline`, use in place of sleeping for the frame
+
+        Args:
+          deadline: `time.perf_counter` time to return at
+          interval_ms: time between polls in milliseconds
+        Returns:
+          list of all events that are not mouse motion
+        """
+        events = self.poll()
+        while time.perf_counter() < deadline:
+            pygame.time.wait(interval_ms)
+            events.extend(self.poll())
+        return events
+
+    def value(self):
+        """
+        Returns the human input for the current control step, between -1.0 and 1.0
+        """
+        return self.filtered
+
+    def value_at(self, t):
+        """
+        Returns the human input as it was at time `t`, for control steps that run late
+        and catch up on the time they were due
+
+        Args:
+          t: `time.perf_counter` time, up to the last poll
+        """
+        i = np.searchsorted(self.timestamps[:self.n_samples], t, side="right") - 1
+        return float(self.values[i]) if i >= 0 else self.initial
+
+    def arrays(self):
+        """
+        Returns the recorded input stream, ready to be saved with the session data
+
+        Returns:
+          dict with `input_timestamps` (seconds, `time.perf_counter` clock) and
+          `input_samples` (scaled mouse x position)
+        """
+        return {
+            "input_timestamps": self.timestamps[:self.n_samples].copy(),
+            "input_samples": self.samples[:self.n_samples].copy(),
+        }
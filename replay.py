@@ -0,0 +1,160 @@
+import argparse
+import collections
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cost
+from experiments import make_agent
+from loading import SessionLoader, ArchiveLoader
+
+REPLAY_DIRECTORY = "replay"
+
+# ==========================================
+#                 REPLAY
+# ==========================================
+
+def replay_inputs(agent_name, params, human_inputs):
+    """
+    Open-loop replay: feeds recorded human inputs to a new agent.
+
+    The human inputs are replayed exactly as recorded, the recorded human never reacts to
+    the new machine actions. The result answers "what would this agent have done against
+    these hand movements", not "how would this session have played out".
+
+    All sessions are stepped together as one batch. Shorter sessions are padded with their
+    last input and trimmed afterwards, which leaves their frames untouched since the
+    sessions of a batched agent are independent.
+
+    Args:
+      agent_name: class name of the agent in `experiments.py`
+      params: dict of constructor arguments of the agent
+      human_inputs: list of 1D arrays, the recorded `human_inputs` of every session
+    Returns:
+      list with a dict of arrays per session, with the keys written by `DataBase.write`
+    """
+    lengths = [len(h) for h in human_inputs]
+    n_frames = max(lengths, default=0)
+    stack = np.empty((len(human_inputs), n_frames), dtype=np.float64)
+    for row, h in zip(stack, human_inputs):
+        row[:len(h)] = h
+        row[len(h):] = h[-1] if len(h) else 0.0
+
+    agent = make_agent(agent_name, n_sessions=len(human_inputs), **params)
+    machine_inputs = np.empty_like(stack)
+    for frame in range(n_frames):
+        machine_inputs[:, frame] = agent.step(stack[:, frame])
+
+    human_scores = cost.get_human_cost(stack, machine_inputs)
+    machine_scores = cost.get_machine_cost(stack, machine_inputs)
+    return [{
+        "human_inputs": stack[i, :n],
+        "machine_inputs": machine_inputs[i, :n],
+        "human_scores": human_scores[i, :n],
+        "machine_scores": machine_scores[i, :n],
+    } for i, n in enumerate(lengths)]
+
+def _session_name(source):
+    """
+    Returns the file name of a replayed session: the hash of the recorded session
+    """
+    return os.path.splitext(os.path.basename(source.split(ArchiveLoader.SEPARATOR)[-1]))[0]
+
+def _replay_chunk(agent_name, params, sources, human_inputs, directory):
+    """
+    Replays a chunk of sessions and saves them. Runs in a worker process
+    """
+    # the recorded human never pulls back an agent that runs away, its machine actions
+    # may overflow to inf or NaN and are saved that way, as the replay of that agent
+    with np.errstate(over="ignore", invalid="ignore"):
+        sessions = replay_inputs(agent_name, params, human_inputs)
+    description = json.dumps({"agent": agent_name, "params": params}, sort_keys=True)
+    for source, session in zip(sources, sessions):
+        file_path = os.path.join(directory, f"{_session_name(source)}.npz")
+        with open(file_path + ".tmp", "wb") as f:
+            np.savez_compressed(f, **session, source=np.str_(source), replay=np.str_(description),
+                                open_loop=np.bool_(True))
+        os.replace(file_path + ".tmp", file_path)
+    return len(sessions)
+
+def replay(loader, round_num, label, agent_name, params=None, out_root=REPLAY_DIRECTORY,
+           workers=None, chunk_size=500):
+    """
+    Replays the recorded human inputs of one experiment through an agent.
+
+    Sessions are loaded by `loader` and replayed in chunks of `chunk_size` sessions spread
+    over a process pool, the next chunk is only loaded once fewer than `workers` are
+    waiting to be replayed. Every replayed session is saved as
+    `{out_root}/round_{round_num}_{label}/{hash}.npz`, with the hash of the recorded
+    session, in the schema of `DataBase.write`, so `visualize.py --data-root {out_root}`
+    plots the counterfactual runs the same way as the real ones. Each file also stores
+    the recorded session it came from (`source`) and the agent with its parameters
+    (`replay`, as JSON).
+
+    Args:
+      loader: a `SessionLoader` or `ArchiveLoader` with the recorded sessions
+      round_num: round of the recorded sessions
+      label: experiment label of the recorded sessions, e.g. "Exp3"
+      agent_name: class name of the agent in `experiments.py`
+      params: dict of constructor arguments of the agent
+      out_root: directory of the replayed `round_*` folders
+      workers: number of processes, defaults to the number of cores
+      chunk_size: number of sessions stepped together in one process
+    Returns:
+      the number of replayed sessions
+    """
+    params = params or {}
+    # fail before spawning processes on a bad agent name or parameters
+    make_agent(agent_name, **params)
+    files = loader.files(round_num, label)
+    directory = os.path.join(out_root, f"round_{round_num}_{label}")
+    os.makedirs(directory, exist_ok=True)
+
+    count = 0
+    workers = workers or os.cpu_count() or 1
+    # submit one chunk at a time, at most `workers` are loaded and not yet replayed
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start, chunk in zip(range(0, len(files), chunk_size),
+                                loader.iter_load(files, keys=("human_inputs",), chunk_size=chunk_size)):
+            if len(pending) >= workers:
+                count += pending.popleft().result()
+            sources = files[start:start + chunk_size]
+            pending.append(pool.submit(_replay_chunk, agent_name, params, sources,
+                                       [session["human_inputs"] for session in chunk], directory))
+        count += sum(future.result() for future in pending)
+    return count
+
+def _parse_params(items):
+    params = {}
+    for item in items:
+        name, value = item.split("=", 1)
+        try:
+            params[name] = json.loads(value)
+        except json.JSONDecodeError:
+            params[name] = value
+    return params
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Open-loop replay of recorded human inputs through an agent. The recorded "
+                    "humans do not react to the new machine actions")
+    parser.add_argument("agent", help="agent class in experiments.py, e.g. AI_Exp3")
+    parser.add_argument("params", nargs="*", metavar="NAME=VALUE",
+                        help="agent arguments, e.g. mini_round_frames=180 gamma=2")
+    parser.add_argument("--round", type=int, required=True, help="round of the recorded sessions")
+    parser.add_argument("--label", default=None, help="experiment label, defaults to Exp{round}")
+    parser.add_argument("--data-root", default="data", help="directory holding the round_* folders")
+    parser.add_argument("--archives", nargs="*", default=None, metavar="ZIP",
+                        help="read the sessions straight from zip archives, e.g. data.zip data1.zip")
+    parser.add_argument("--out", default=REPLAY_DIRECTORY, help="directory of the replayed round_* folders")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args()
+
+    if args.archives:
+        loader = ArchiveLoader(args.archives, cache_directory=None)
+    else:
+        loader = SessionLoader(args.data_root, cache_directory=None)
+    label = args.label or f"Exp{args.round}"
+    count = replay(loader, args.round, label, args.agent, _parse_params(args.params), args.out, args.workers)
+    print(f"Replayed {count} sessions to {os.path.join(args.out, f'round_{args.round}_{label}')}")
@@ -0,0 +1,502 @@
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cost import get_human_cost, get_machine_cost
+from data import DataBase
+from experiments import RelativeChange, make_agent
+from timing import FrameTimer
+from game_clock import GameClock
+
+# Protocol: newline delimited JSON messages over TCP.
+#
+#   client -> server  {"type": "hello", "round": 3}           first message, optional
+#                                                           "agent", "params", "frames" and
+#                                                           "convergence": {"window": 3, "tolerance": 0.05}
+#                                                           to end Exp2/Exp3 once L_M settled
+#   server -> client  {"type": "start", "session": id, "tick_rate": 60, "frames": n}
+#   client -> server  {"type": "input", "h": -0.4, "t": 12.5}  at any rate, "t" is echoed
+#   server -> client  {"type": "frame", "frame": i, "m": .., "cost": .., "height": .., "t": ..}
+#   client -> server  {"type": "bye"}                          ends the session early
+#   server -> client  {"type": "end", "frames": n, "complete": true}
+#
+# "height" is the rectangle height as a fraction of the screen, the client only has to
+# multiply it by its screen height. "t" in a frame echoes the "t" of the newest input
+# used, so clients can measure their input to display latency on their own clock.
+
+DEFAULT_PORT = 8765
+TICK_RATE = 60
+# Longest session a client may ask for, 10 minutes at 60 ticks per second
+MAX_FRAMES = 36000
+# Seconds a new connection has to send its hello
+HELLO_TIMEOUT = 10.0
+# Longest input line, a client sending more without a newline is disconnected
+MAX_LINE = 4096
+
+# The experiments of `game.run_game`: agent, agent parameters and duration in frames
+EXPERIMENTS = {
+    1: ("AI_Exp1", {"alpha": 0.3}, 600),
+    2: ("AI_Exp2", {"mini_round_frames": 180}, 3600),
+    3: ("AI_Exp3", {"mini_round_frames": 180, "gamma": 1.0}, 3600),
+}
+
+# Sections of a server tick timed by `FrameTimer`
+TICK_SECTIONS = ("agent", "cost", "database", "send")
+
+# Largest human cost, the top of the screen, see `game_gui._get_human_display_value`
+MAX_HUMAN_COST = 596 / 375
+
+def _encode(message):
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+def _decode(line):
+    """
+    Parses a message, anything but a JSON object is an empty message
+    """
+    message = json.loads(line)
+    return message if isinstance(message, dict) else {}
+
+# ==========================================
+#                SESSIONS
+# ==========================================
+
+class Session:
+    """
+    One participant: an agent, a `DataBase` and a fixed-rate tick loop.
+
+    The client sends input samples whenever it likes, the tick loop uses the newest one,
+    exactly like `run_round` uses the newest mouse position. Every tick is sent back as
+    a frame update. Frame updates only describe the current state, so when a client reads
+    too slowly and its send buffer fills up, updates are dropped instead of queued and the
+    tick loop never waits on a client.
+    """
+    def __init__(self, round_num, agent_name, params, n_frames, writer,
+                 tick_rate=TICK_RATE, max_buffer=64 * 1024, convergence=None):
+        """
+        Args:
+          round_num: round of the session
+          agent_name: agent class in `experiments.py`
+          params: agent constructor arguments
+          n_frames: length of the session in frames
+          writer: `asyncio.StreamWriter` of the client
+          tick_rate: ticks per second
+          max_buffer: bytes buffered for the client above which updates are dropped
+          convergence: optional convergence test of a `TrialAgent`, ends the session once
+            the agent converged
+        """
+        self.round_num = round_num
+        self.label = f"Exp{round_num}"
+        self.agent_name = agent_name
+        self.params = params
+        self.n_frames = n_frames
+        self.writer = writer
+        self.tick_rate = tick_rate
+        self.max_buffer = max_buffer
+
+        if convergence is not None:
+            self.agent = make_agent(agent_name, convergence=convergence, **params)
+        else:
+            self.agent = make_agent(agent_name, **params)
+        self.database = DataBase(n_frames)
+        # the file hash of the session's data identifies the session
+        self.session_id = self.database.file_hash
+        self.timer = FrameTimer(n_frames, tick_rate, TICK_SECTIONS)
+        self.h = 0.0
+        self.input_time = None
+        self.n_inputs = 0
+        self.dropped_updates = 0
+        self.clock = GameClock(n_frames, tick_rate)
+        self.disconnected = False
+        self.complete = False
+        self.stopped_early = False
+
+    async def read_inputs(self, reader):
+        """
+        Reads input samples until the client leaves.
+
+        Only the newest input of every read is used by the next tick, so the older input
+        lines of a read are counted but never parsed.
+        """
+        pending = b""
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                if len(pending) > MAX_LINE:
+                    break
+                self.n_inputs += len(lines)
+                if b'"bye"' in chunk and any(_decode(line).get("type") == "bye" for line in lines):
+                    break
+                if lines:
+                    message = _decode(lines[-1])
+                    if message.get("type") == "input":
+                        h = float(message["h"])
+                        if math.isfinite(h):
+                            self.h = min(1.0, max(-1.0, h))
+                        self.input_time = message.get("t")
+        except (ConnectionError, ValueError, KeyError, TypeError):
+            pass
+        self.disconnected = True
+
+    def _send(self, message):
+        """
+        Queues a frame update unless the client is too far behind
+        """
+        if self.writer.transport.get_write_buffer_size() > self.max_buffer:
+            self.dropped_updates += 1
+            return
+        self.writer.write(_encode(message))
+
+    async def run(self):
+        """
+        Runs the tick loop until the session ends or the client leaves.
+
+        Ticks follow a fixed-timestep `GameClock`: ticks that fall behind while the event
+        loop is busy are caught up back to back, so a session always lasts
+        `n_frames / tick_rate` seconds. Only the newest of them is sent to the client.
+
+        Returns:
+          True if all `n_frames` frames were played
+        """
+        loop = asyncio.get_running_loop()
+        clock = self.clock
+        clock.time_function = loop.time
+        clock.start()
+        while not clock.done:
+            delay = clock.next_step_time() - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.disconnected:
+                return False
+            for _ in clock.due_steps():
+                self.timer.start_frame()
+
+                # 1-3. Get Machine Action from the Agent, which also stores the frame
+                h_val = self.h
+                m_val = self.agent.step(h_val)
+                self.timer.mark("agent")
+
+                # 4. Calculate Costs
+                c_h = get_human_cost(h_val, m_val)
+                c_m = get_machine_cost(h_val, m_val)
+                self.timer.mark("cost")
+
+                # 5. Save Real Data
+                self.database.append(h_val, m_val, c_h, c_m)
+                self.timer.mark("database")
+                if self.agent.done:
+                    break
+
+            if self.agent.done:
+                # the agent converged, the session ends early and complete
+                self.stopped_early = True
+                break
+            if not clock.render_due():
+                continue
+            self._send({"type": "frame", "frame": clock.steps - 1, "m": float(m_val), "cost": float(c_h),
+                        "height": math.sqrt(max(float(c_h), 0.0) / MAX_HUMAN_COST),
+                        "t": self.input_time})
+            self.timer.mark("send")
+        return True
+
+    def stats(self):
+        return {"session": self.session_id, "label": self.label, "frames": self.database.current_frame,
+                "inputs": self.n_inputs, "dropped_updates": self.dropped_updates,
+                "caught_up_ticks": self.clock.caught_up_steps, "stopped_early": self.stopped_early}
+
+# ==========================================
+#           BATCHED PERSISTENCE
+# ==========================================
+
+class Persister:
+    """
+    Saves finished sessions in batches on a worker thread.
+
+    Finished sessions are queued, and every `interval` seconds, or as soon as `batch_size`
+    sessions are waiting, the whole batch is written in one thread hop. The event loop
+    never blocks on compression or disk writes.
+    """
+    def __init__(self, store=None, batch_size=32, interval=1.0):
+        """
+        Args:
+          store: optional `store.SessionStore`, see `DataBase.write`
+          batch_size: largest number of sessions written together
+          interval: longest time in seconds a finished session waits to be written
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = asyncio.Queue()
+        self.n_written = 0
+
+    def submit(self, session):
+        self.queue.put_nowait(session)
+
+    def _write_batch(self, batch):
+        for session in batch:
+            params = {"agent": session.agent_name, **session.params}
+            session.database.write(f"{session.round_num}_{session.label}", store=self.store, params=params,
+                                   complete=session.complete)
+
+    async def run(self):
+        """
+        Writes batches until cancelled, then writes what is left
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                deadline = loop.time() + self.interval
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                await asyncio.to_thread(self._write_batch, batch)
+                self.n_written += len(batch)
+        except asyncio.CancelledError:
+            batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self._write_batch(batch)
+            self.n_written += len(batch)
+            raise
+
+# ==========================================
+#                 SERVER
+# ==========================================
+
+class SessionServer:
+    """
+    Hosts many concurrent game sessions in one asyncio event loop.
+
+    Every connection is one participant playing one round, with its own agent, its own
+    `DataBase` and its own tick loop, see `Session`. Finished sessions are saved through
+    a shared `Persister`.
+    """
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, tick_rate=TICK_RATE, max_sessions=512,
+                 store=None, max_buffer=64 * 1024):
+        """
+        Args:
+          host, port: address to listen on
+          tick_rate: ticks per second of every session
+          max_sessions: connections above this many are refused
+          store: optional `store.SessionStore` to save sessions to instead of .npz files
+          max_buffer: bytes buffered per client above which frame updates are dropped
+        """
+        self.host = host
+        self.port = port
+        self.tick_rate = tick_rate
+        self.max_sessions = max_sessions
+        self.max_buffer = max_buffer
+        self.persister = Persister(store)
+        self.sessions = {}
+        self.n_started = 0
+
+    async def _handle(self, reader, writer):
+        session = None
+        try:
+            hello = _decode(await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT) or "{}")
+            if hello.get("type") != "hello":
+                raise ValueError("first message must be a hello")
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError("server is full")
+            round_num = int(hello.get("round", 1))
+            agent_name, params, n_frames = EXPERIMENTS[round_num]
+            session = Session(round_num, hello.get("agent", agent_name),
+                              dict(params, **hello.get("params", {})),
+                              min(max(int(hello.get("frames", n_frames)), 1), MAX_FRAMES),
+                              writer, self.tick_rate, self.max_buffer,
+                              RelativeChange(**hello["convergence"]) if "convergence" in hello else None)
+        except (ValueError, KeyError, TypeError, OverflowError, asyncio.TimeoutError) as e:
+            # OverflowError: a round or frames of e.g. 1e400 parses to an infinite float
+            writer.write(_encode({"type": "error", "message": str(e) or "no hello received"}))
+            await _close(writer)
+            return
+        except ConnectionError:
+            await _close(writer)
+            return
+
+        self.sessions[session.session_id] = session
+        self.n_started += 1
+        writer.write(_encode({"type": "start", "session": session.session_id,
+                              "tick_rate": self.tick_rate, "frames": session.n_frames}))
+        reader_task = asyncio.create_task(session.read_inputs(reader))
+        try:
+            complete = await session.run()
+        finally:
+            reader_task.cancel()
+            del self.sessions[session.session_id]
+        session.complete = complete
+        session.database.attach(session.timer.arrays())
+        session.database.attach(session.agent.metadata())
+        session.database.attach({"stopped_early": np.bool_(session.stopped_early),
+                                 "planned_steps": np.int64(session.n_frames)})
+        self.persister.submit(session)
+        print(f"[{session.label}] session {session.session_id} "
+              f"{'finished' if complete else 'left'}: {session.stats()}")
+        if not session.disconnected:
+            writer.write(_encode({"type": "end", "frames": session.database.current_frame,
+                                  "complete": complete}))
+        await _close(writer)
+
+    async def serve(self):
+        """
+        Serves until cancelled
+        """
+        persister_task = asyncio.create_task(self.persister.run())
+        server = await asyncio.start_server(self._handle, self.host, self.port, backlog=self.max_sessions)
+        print(f"Serving on {self.host}:{self.port} at {self.tick_rate} ticks per second")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            persister_task.cancel()
+            await asyncio.gather(persister_task, return_exceptions=True)
+            print(f"Saved {self.persister.n_written} sessions")
+
+async def _close(writer):
+    try:
+        writer.close()
+        await asyncio.wait_for(writer.wait_closed(), 5.0)
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+
+# ==========================================
+#          SCRIPTED LOAD-TEST CLIENT
+# ==========================================
+
+async def run_client(host="127.0.0.1", port=DEFAULT_PORT, round_num=1, frames=None, input_rate=60,
+                     seed=0):
+    """
+    Scripted participant moving its input along a noisy sine wave
+
+    Args:
+      host, port: address of the server
+      round_num: round to play
+      frames: length of the session, defaults to the length of the round
+      input_rate: input samples sent per second
+      seed: seed for the random number generator
+    Returns:
+      dict with the frame updates received, the session length and the input to update
+      latencies in seconds
+    """
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    hello = {"type": "hello", "round": round_num}
+    if frames is not None:
+        hello["frames"] = frames
+    writer.write(_encode(hello))
+    start = json.loads(await reader.readline())
+    if start["type"] != "start":
+        writer.close()
+        raise ConnectionError(start.get("message", "session refused"))
+
+    phase = rng.uniform(0, 2 * np.pi)
+
+    async def send_inputs():
+        t0 = time.perf_counter()
+        while True:
+            t = time.perf_counter()
+            h = 0.8 * math.sin(phase + (t - t0) * 2.0) + rng.normal(0, 0.02)
+            writer.write(_encode({"type": "input", "h": h, "t": t}))
+            await writer.drain()
+            await asyncio.sleep(1.0 / input_rate)
+
+    sender = asyncio.create_task(send_inputs())
+    latencies = []
+    n_updates = 0
+    end = None
+    try:
+        async for line in reader:
+            message = json.loads(line)
+            if message["type"] == "frame":
+                n_updates += 1
+                if message["t"] is not None:
+                    latencies.append(time.perf_counter() - message["t"])
+            elif message["type"] == "end":
+                end = message
+                break
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        await _close(writer)
+    return {"updates": n_updates, "frames": end["frames"] if end else 0, "latencies": latencies}
+
+async def _run_clients(seeds, host, port, frames, input_rate):
+    return await asyncio.gather(*(run_client(host, port, seed % 3 + 1, frames, input_rate, seed)
+                                  for seed in seeds), return_exceptions=True)
+
+def _client_process(seeds, host, port, frames, input_rate):
+    """
+    Runs a share of the clients of `load_test` in its own event loop
+    """
+    results = asyncio.run(_run_clients(seeds, host, port, frames, input_rate))
+    # exceptions may not pickle, send their description back
+    return [repr(r) if isinstance(r, Exception) else r for r in results]
+
+def load_test(n_clients, host="127.0.0.1", port=DEFAULT_PORT, frames=600, input_rate=60, processes=1):
+    """
+    Runs `n_clients` scripted clients at once, spread over the three rounds, and prints
+    update and latency statistics
+
+    Args:
+      n_clients: number of clients
+      host, port: address of the server
+      frames: length of every session
+      input_rate: input samples sent per second by every client
+      processes: number of client processes. Hundreds of clients sending at 60 Hz
+        saturate a single process, which then shows up as latency that is not the server's
+    """
+    shares = [range(i, n_clients, processes) for i in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = [r for share in pool.map(_client_process, shares, *zip(*[(host, port, frames, input_rate)] * processes))
+                   for r in share]
+    failed = [r for r in results if isinstance(r, str)]
+    results = [r for r in results if not isinstance(r, str)]
+    latencies = np.concatenate([r["latencies"] for r in results]) if results else np.zeros(0)
+    updates = np.array([r["updates"] for r in results])
+    print(f"{len(results)} clients finished, {len(failed)} failed")
+    for error in sorted(set(failed)):
+        print(f"  failure: {error}")
+    if results:
+        print(f"  updates per client: min {updates.min()} | mean {updates.mean():.1f} | ticks per session {frames}")
+    if len(latencies):
+        print(f"  input to update latency: p50 {np.percentile(latencies, 50) * 1000:.2f} ms | "
+              f"p99 {np.percentile(latencies, 99) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-participant game server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="host sessions")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--tick-rate", type=int, default=TICK_RATE)
+    serve.add_argument("--max-sessions", type=int, default=512)
+    serve.add_argument("--store", default=None, help="save sessions to a SessionStore directory")
+    test = subparsers.add_parser("loadtest", help="run scripted clients against a server")
+    test.add_argument("--host", default="127.0.0.1")
+    test.add_argument("--port", type=int, default=DEFAULT_PORT)
+    test.add_argument("--clients", type=int, default=100)
+    test.add_argument("--frames", type=int, default=600)
+    test.add_argument("--input-rate", type=int, default=60, help="input samples per second per client")
+    test.add_argument("--processes", type=int, default=1, help="number of client processes")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        store = None
+        if args.store:
+            from store import SessionStore
+            store = SessionStore(args.store)
+        try:
+            asyncio.run(SessionServer(args.host, args.port, args.tick_rate, args.max_sessions, store).serve())
+        except KeyboardInterrupt:
+            pass
+    else:
+        load_test(args.clients, args.host, args.port, args.frames, args.input_rate, args.processes)
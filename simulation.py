@@ -0,0 +1,265 @@
+import csv
+import numpy as np
+import cost
+from experiments import AI_Exp1, AI_Exp2, AI_Exp3
+
+# ==========================================
+#            SYNTHETIC HUMAN MODELS
+# ==========================================
+
+class BestResponseHuman:
+    """
+    Synthetic human that moves towards the best response to `get_human_cost`.
+
+    Each frame the human sees the machine action from `lag` frames ago and takes a
+    gradient step of size `step` on the human cost. With `step = 1 / AH` the step lands
+    exactly on the best response. The step can be capped with `max_step` to model a
+    hand that can only move so far per frame, and gaussian `noise` is added on top.
+    """
+    def __init__(self, noise=0.0, lag=0, step=1.0, max_step=None, seed=None):
+        """
+        Args:
+          noise: standard deviation of the gaussian noise added to h every frame
+          lag: number of frames between a machine action and the human reacting to it
+          step: gradient step size on the human cost
+          max_step: largest change in h per frame, `None` for no limit
+          seed: seed for the random number generator
+        """
+        self.noise = noise
+        self.lag = lag
+        self.step = step
+        self.max_step = max_step
+        self.rng = np.random.default_rng(seed)
+        self.h = None
+
+    def reset(self, n_sessions, h0=None):
+        """
+        Starts `n_sessions` new humans
+
+        Args:
+          n_sessions: number of independent sessions
+          h0: initial human input, scalar or array. `None` draws it uniformly from [-1, 1]
+        """
+        if h0 is None:
+            h0 = self.rng.uniform(-1.0, 1.0, n_sessions)
+        self.h = np.broadcast_to(np.asarray(h0, dtype=np.float64), (n_sessions,)).copy()
+        # ring buffer of the last `lag + 1` machine actions
+        self.past_m = np.zeros((self.lag + 1, n_sessions))
+        self.n_seen = 0
+
+    def get_action(self):
+        """
+        Returns the current human input for every session
+        """
+        return self.h
+
+    def observe(self, m):
+        """
+        Shows the humans the machine action of the current frame and updates h
+
+        Args:
+          m: machine action of every session
+        """
+        self.past_m[self.n_seen % (self.lag + 1)] = m
+        self.n_seen += 1
+        if self.n_seen <= self.lag:
+            # nothing has reached the human yet
+            return
+        seen_m = self.past_m[self.n_seen % (self.lag + 1)]
+
+        dh = -self.step * cost.get_human_gradient(self.h, seen_m)
+        if self.max_step is not None:
+            dh = np.clip(dh, -self.max_step, self.max_step)
+        if self.noise > 0:
+            dh = dh + self.rng.normal(0.0, self.noise, self.h.shape)
+        self.h = np.clip(self.h + dh, -1.0, 1.0)
+
+class LaggedLinearHuman:
+    """
+    Synthetic human following the lagged linear response fitted by `sysid.py`:
+
+      h_t = a + rho * h_{t-1} + L_H * m_{t-lag} + noise
+
+    Every session has its own parameters, e.g. one fitted participant each. Until the
+    first machine action has reached a session the human stays at its initial input.
+    Parameters fitted to closed loop sessions are not a causal model of the human, see
+    `sysid.fit_sessions`.
+    """
+    def __init__(self, a, L_H, lag, noise=0.0, rho=0.0, seed=None):
+        """
+        Args:
+          a, L_H: intercept and slope of the response, scalars or one value per parameter set
+          lag: delay in frames, at least 1, scalar or one value per parameter set
+          noise: standard deviation of the gaussian noise, scalar or one value per set
+          rho: weight of the previous human input, scalar or one value per set
+          seed: seed for the random number generator
+        """
+        self.a, self.L_H, self.lag, self.noise, self.rho = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(a, dtype=np.float64)), np.atleast_1d(np.asarray(L_H, dtype=np.float64)),
+            np.atleast_1d(np.maximum(np.asarray(lag, dtype=np.int64), 1)),
+            np.atleast_1d(np.asarray(noise, dtype=np.float64)), np.atleast_1d(np.asarray(rho, dtype=np.float64)))
+        self.rng = np.random.default_rng(seed)
+        self.h = None
+
+    @classmethod
+    def from_table(cls, file_path, experiment=None, min_r2=0.0, noise_scale=1.0, seed=None):
+        """
+        Creates the humans from a parameter table written by `sysid.py`. Tables without
+        a "rho" column were fitted without the h_{t-1} term, their L_H is mostly the
+        inverse of the machine's policy, so they are refused. Rows with |rho| of 1 or
+        more would drift to the edge of the screen on their own and are left out
+
+        Args:
+          file_path: CSV table of `sysid.fit_table`
+          experiment: only use the sessions of this experiment, e.g. "Exp2"
+          min_r2: leave out sessions fitted worse than this
+          noise_scale: factor on the fitted residual noise, 0 for noiseless humans
+          seed: seed for the random number generator
+        """
+        with open(file_path, newline="") as f:
+            rows = [row for row in csv.DictReader(f)
+                    if (experiment is None or row["experiment"] == experiment) and float(row["r2"]) >= min_r2]
+        if rows and "rho" not in rows[0]:
+            raise ValueError(f"{file_path} has no rho column, re-run sysid.py")
+        rows = [row for row in rows if abs(float(row["rho"])) < 1.0]
+        if not rows:
+            raise ValueError(f"No stable fitted sessions in {file_path}")
+        column = lambda name: np.array([float(row[name]) for row in rows])
+        return cls(column("a"), column("L_H"), column("lag").astype(np.int64),
+                   noise_scale * column("noise"), column("rho"), seed)
+
+    def reset(self, n_sessions, h0=None):
+        """
+        Starts `n_sessions` new humans. With as many sessions as parameter sets each
+        session gets its own set, otherwise the sets are drawn with replacement
+
+        Args:
+          n_sessions: number of independent sessions
+          h0: initial human input, scalar or array. `None` draws it uniformly from [-1, 1]
+        """
+        if n_sessions == len(self.a):
+            index = np.arange(n_sessions)
+        else:
+            index = self.rng.integers(0, len(self.a), n_sessions)
+        self.session_a, self.session_L_H = self.a[index], self.L_H[index]
+        self.session_lag, self.session_noise = self.lag[index], self.noise[index]
+        self.session_rho = self.rho[index]
+        if h0 is None:
+            h0 = self.rng.uniform(-1.0, 1.0, n_sessions)
+        self.h = np.broadcast_to(np.asarray(h0, dtype=np.float64), (n_sessions,)).copy()
+        # ring buffer of the last machine actions, long enough for the longest lag
+        self.past_m = np.zeros((int(self.session_lag.max()) + 1, n_sessions))
+        self.n_seen = 0
+
+    def get_action(self):
+        """
+        Returns the current human input for every session
+        """
+        return self.h
+
+    def observe(self, m):
+        """
+        Shows the humans the machine action of the current frame and sets h of the next one
+
+        Args:
+          m: machine action of every session
+        """
+        size = len(self.past_m)
+        self.past_m[self.n_seen % size] = m
+        self.n_seen += 1
+        # the action of frame n_seen - lag drives the next frame
+        seen_m = self.past_m[(self.n_seen - self.session_lag) % size, np.arange(len(self.h))]
+        h = self.session_a + self.session_rho * self.h + self.session_L_H * seen_m
+        if self.noise.any():
+            h = h + self.rng.normal(0.0, 1.0, self.h.shape) * self.session_noise
+        self.h = np.where(self.n_seen >= self.session_lag, np.clip(h, -1.0, 1.0), self.h)
+
+# ==========================================
+#               SIMULATION
+# ==========================================
+
+def simulate_round(ai_agent, human, n_frames, n_sessions, h0=None, track=None):
+    """
+    Runs `n_sessions` rounds of the game side by side without a window.
+
+    Mirrors the frame loop of `game.run_round` with the mouse replaced by `human`.
+
+    Args:
+      ai_agent: an agent from `experiments.py` created with `n_sessions`
+      human: a synthetic human such as `BestResponseHuman`
+      n_frames: length of the round in frames
+      n_sessions: number of independent sessions
+      h0: initial human input, see `BestResponseHuman.reset`
+      track: optional name of an agent attribute, e.g. "L_M", recorded after every frame
+    Returns:
+      dict with the same keys as the files written by `DataBase.write`, each an array of
+      shape (n_sessions, n_frames). With `track` the recorded attribute is added under
+      its own name
+    """
+    human.reset(n_sessions, h0)
+    human_inputs = np.zeros((n_sessions, n_frames), dtype=np.float64)
+    machine_inputs = np.zeros((n_sessions, n_frames), dtype=np.float64)
+    tracked = np.zeros((n_sessions, n_frames), dtype=np.float64) if track else None
+
+    for frame in range(n_frames):
+        # 1. Get Human Input
+        h_val = human.get_action()
+        # 2-3. Get Machine Action from the Agent and let it store the frame
+        m_val = ai_agent.step(h_val)
+        # 4. Save, costs are computed for all frames at once below
+        human_inputs[:, frame] = h_val
+        machine_inputs[:, frame] = m_val
+        # 5. Let the humans react
+        human.observe(m_val)
+        if track:
+            tracked[:, frame] = getattr(ai_agent, track)
+
+    results = {
+        "human_inputs": human_inputs,
+        "machine_inputs": machine_inputs,
+        "human_scores": cost.get_human_cost(human_inputs, machine_inputs),
+        "machine_scores": cost.get_machine_cost(human_inputs, machine_inputs)
+    }
+    if track:
+        results[track] = tracked
+    return results
+
+def simulate_game(n_sessions, human=None, seed=None):
+    """
+    Runs the three experiments of `game.run_game` for `n_sessions` synthetic humans.
+
+    Args:
+      n_sessions: number of independent sessions per experiment
+      human: synthetic human model, defaults to a noisy, lagged `BestResponseHuman`
+      seed: seed used for the default human
+    Returns:
+      dict mapping the experiment label ("Exp1", "Exp2", "Exp3") to a tuple of
+      (agent, results) where `results` is the output of `simulate_round`
+    """
+    if human is None:
+        human = BestResponseHuman(noise=0.01, lag=10, step=0.1, max_step=0.05, seed=seed)
+
+    MINI_ROUND_FRAMES = 3 * 60
+    MINI_ROUNDS = 10
+    agents = {
+        "Exp1": (AI_Exp1(alpha=0.3, n_sessions=n_sessions), 600),
+        "Exp2": (AI_Exp2(MINI_ROUND_FRAMES, n_sessions=n_sessions), MINI_ROUND_FRAMES * MINI_ROUNDS * 2),
+        "Exp3": (AI_Exp3(MINI_ROUND_FRAMES, gamma=1.0, n_sessions=n_sessions), MINI_ROUND_FRAMES * MINI_ROUNDS * 2),
+    }
+
+    results = {}
+    for label, (agent, n_frames) in agents.items():
+        results[label] = (agent, simulate_round(agent, human, n_frames, n_sessions))
+    return results
+
+if __name__ == "__main__":
+    N_SESSIONS = 1000
+    print(f"Simulating {N_SESSIONS} sessions per experiment...")
+    for label, (agent, data) in simulate_game(N_SESSIONS, seed=0).items():
+        h_end = data["human_inputs"][:, -1]
+        m_end = data["machine_inputs"][:, -1]
+        print(f"[{label}] final h: {h_end.mean():.3f} +/- {h_end.std():.3f} | "
+              f"final m: {m_end.mean():.3f} +/- {m_end.std():.3f} | "
+              f"final c_M: {data['machine_scores'][:, -1].mean():.4f}")
+        if hasattr(agent, "L_M"):
+            print(f"       learned L_M: {agent.L_M.mean():.3f} +/- {agent.L_M.std():.3f}")
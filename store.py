@@ -0,0 +1,337 @@
+import argparse
+import io
+import json
+import os
+import re
+import time
+import zipfile
+import numpy as np
+
+COLUMNS = ("human_inputs", "machine_inputs", "human_scores", "machine_scores")
+
+# One fixed size record per session, appended to `index.bin`
+INDEX_DTYPE = np.dtype([
+    ("session_id", "S16"),
+    ("round", "i4"),
+    ("label", "S16"),
+    ("timestamp", "f8"),
+    ("offset", "i8"),
+    ("n_frames", "i8"),
+    ("params", "S256"),
+    ("extras_offset", "i8"),
+    ("extras_size", "i8"),
+])
+
+# Layout version written to `meta.json`, stores of another version have to be re-imported
+STORE_VERSION = 2
+
+# matches `.../round_{n}_{label}/{hash}.npz` as written by `DataBase.write`
+MEMBER_PATTERN = re.compile(r"round_(\d+)(?:_([^/\\]+))?[/\\]([0-9a-zA-Z]+)\.npz$")
+
+class SessionStore:
+    """
+    Append-only columnar store holding every session of every experiment.
+
+    Each experiment label gets its own directory with one raw binary file per column
+    and an `index.bin` of `INDEX_DTYPE` records. Every other array of a session, e.g.
+    the step times, the agent's `L_M_history` or `stopped_early`, is kept as one
+    uncompressed `.npz` blob per session in `extras.bin`. Sessions are appended to the
+    end of the column files and the index record is written last, so a crash mid-append
+    never leaves a visible half-written session. The next append cuts the column files,
+    the extras and a torn index record back to the end of the last complete session.
+    Reads are memory mapped, a query only touches the index and the slices of the
+    columns it returns.
+
+      store/
+        Exp1/
+          meta.json
+          index.bin
+          human_inputs.bin
+          ...
+          extras.bin
+    """
+    def __init__(self, root, dtype=np.float64):
+        """
+        Args:
+          root: directory of the store, created if it does not exist
+          dtype: column dtype for experiments created by this store, float32 or float64
+        """
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        # label -> (index file size, index memmap, {column: memmap})
+        self._maps = {}
+        os.makedirs(root, exist_ok=True)
+
+    def labels(self):
+        """
+        Returns the experiment labels in the store
+        """
+        return sorted(d for d in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.root, d, "meta.json")))
+
+    def _directory(self, label):
+        return os.path.join(self.root, label)
+
+    def _column_dtype(self, label):
+        meta_path = os.path.join(self._directory(label), "meta.json")
+        if not os.path.exists(meta_path):
+            os.makedirs(self._directory(label), exist_ok=True)
+            with open(meta_path, "w") as f:
+                json.dump({"dtype": self.dtype.str, "columns": COLUMNS, "version": STORE_VERSION}, f)
+            return self.dtype
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("version", 1) != STORE_VERSION:
+            raise ValueError(f"{self._directory(label)} was written by another version of the store, "
+                             f"re-import the sessions")
+        return np.dtype(meta["dtype"])
+
+    def append(self, columns, round_num, label, session_id, params=None, timestamp=None):
+        """
+        Appends a single session
+
+        Args:
+          columns: dict mapping each name in `COLUMNS` to a 1D array, all of equal length.
+            Any other array, e.g. the `DataBase.attach`ed extras, is kept with the session
+          round_num: the round number of the session
+          label: experiment label, e.g. "Exp1"
+          session_id: unique id of the session
+          params: optional dict of agent parameters, stored as JSON
+          timestamp: unix time of the session, defaults to now
+        """
+        if not label:
+            raise ValueError("Sessions need an experiment label")
+        for name, value in (("session_id", session_id), ("label", label)):
+            if len(value.encode()) > INDEX_DTYPE[name].itemsize:
+                raise ValueError(f"{name} {value!r} is longer than {INDEX_DTYPE[name].itemsize} bytes")
+        n_frames = len(columns[COLUMNS[0]])
+        if any(len(columns[name]) != n_frames for name in COLUMNS):
+            raise ValueError("All columns of a session must have the same length")
+        params = json.dumps(params or {}).encode()
+        if len(params) > INDEX_DTYPE["params"].itemsize:
+            raise ValueError("Agent parameters are too long to be stored in the index")
+        extras = b""
+        if len(columns) > len(COLUMNS):
+            buffer = io.BytesIO()
+            np.savez(buffer, **{name: value for name, value in columns.items() if name not in COLUMNS})
+            extras = buffer.getvalue()
+        dtype = self._column_dtype(label)
+        directory = self._directory(label)
+
+        offset, extras_offset = self._repair(label, dtype)
+        for name in COLUMNS:
+            with open(os.path.join(directory, f"{name}.bin"), "ab") as f:
+                np.asarray(columns[name], dtype=dtype).tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+        with open(os.path.join(directory, "extras.bin"), "ab") as f:
+            f.write(extras)
+            f.flush()
+            os.fsync(f.fileno())
+
+        record = np.array([(session_id.encode(), int(round_num), label.encode(),
+                            time.time() if timestamp is None else timestamp,
+                            offset, n_frames, params, extras_offset, len(extras))], dtype=INDEX_DTYPE)
+        with open(os.path.join(directory, "index.bin"), "ab") as f:
+            record.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _repair(self, label, dtype):
+        """
+        Cuts what a crashed append left behind: a torn index record and column data and
+        extras past the last complete session
+
+        Returns:
+          the offsets of the next session in the columns and in `extras.bin`, the ends of
+          the last complete session
+        """
+        directory = self._directory(label)
+        index_path = os.path.join(directory, "index.bin")
+        end = extras_end = 0
+        if os.path.exists(index_path):
+            size = os.path.getsize(index_path)
+            complete = size - size % INDEX_DTYPE.itemsize
+            if complete != size:
+                os.truncate(index_path, complete)
+            if complete:
+                with open(index_path, "rb") as f:
+                    f.seek(complete - INDEX_DTYPE.itemsize)
+                    last = np.frombuffer(f.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+                end = int(last["offset"]) + int(last["n_frames"])
+                extras_end = int(last["extras_offset"]) + int(last["extras_size"])
+        sizes = {f"{name}.bin": end * dtype.itemsize for name in COLUMNS}
+        sizes["extras.bin"] = extras_end
+        for name, size in sizes.items():
+            file_path = os.path.join(directory, name)
+            if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+                os.truncate(file_path, size)
+        return end, extras_end
+
+    def _open(self, label):
+        """
+        Returns the memory maps of `label`, reopening them if the files have grown
+        """
+        directory = self._directory(label)
+        index_path = os.path.join(directory, "index.bin")
+        size = os.path.getsize(index_path) if os.path.exists(index_path) else 0
+        # a torn record of a crashed append is not part of the store
+        size -= size % INDEX_DTYPE.itemsize
+        cached = self._maps.get(label)
+        if cached is not None and cached[0] == size:
+            return cached[1], cached[2], cached[3]
+
+        extras = np.zeros(0, dtype=np.uint8)
+        if size == 0:
+            index = np.zeros(0, dtype=INDEX_DTYPE)
+            columns = {name: np.zeros(0, dtype=self.dtype) for name in COLUMNS}
+        else:
+            dtype = self._column_dtype(label)
+            index = np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", shape=(size // INDEX_DTYPE.itemsize,))
+            columns = {name: np.memmap(os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r")
+                       for name in COLUMNS}
+            extras_path = os.path.join(directory, "extras.bin")
+            if os.path.exists(extras_path) and os.path.getsize(extras_path):
+                extras = np.memmap(extras_path, dtype=np.uint8, mode="r")
+        self._maps[label] = (size, index, columns, extras)
+        return index, columns, extras
+
+    def query(self, label, round_num=None, since=None, until=None):
+        """
+        Selects sessions of one experiment
+
+        Args:
+          label: experiment label, e.g. "Exp3"
+          round_num: only sessions of this round
+          since: only sessions with a unix timestamp >= `since`
+          until: only sessions with a unix timestamp < `until`
+        Returns:
+          a `SessionSet` of the matching sessions
+        """
+        index, columns, extras = self._open(label)
+        mask = np.ones(len(index), dtype=bool)
+        if round_num is not None:
+            mask &= index["round"] == round_num
+        if since is not None:
+            mask &= index["timestamp"] >= since
+        if until is not None:
+            mask &= index["timestamp"] < until
+        return SessionSet(np.asarray(index[mask]), columns, extras)
+
+    def session_ids(self, label):
+        """
+        Returns the set of session ids stored under `label`
+        """
+        if not os.path.isfile(os.path.join(self._directory(label), "meta.json")):
+            return set()
+        return {session_id.decode() for session_id in self._open(label)[0]["session_id"]}
+
+class SessionSet:
+    """
+    Result of `SessionStore.query`. Column data is read lazily from the memory maps.
+    """
+    def __init__(self, index, columns, extras):
+        self.index = index
+        self._columns = columns
+        self._extras = extras
+
+    def __len__(self):
+        return len(self.index)
+
+    def column(self, name):
+        """
+        Returns a list with the `name` column of every session, as read-only views
+        """
+        data = self._columns[name]
+        return [data[o:o + n] for o, n in zip(self.index["offset"], self.index["n_frames"])]
+
+    def session(self, i):
+        """
+        Returns session `i` as a dict in the same format as the files of `DataBase.write`
+        """
+        o, n = self.index["offset"][i], self.index["n_frames"][i]
+        session = {name: self._columns[name][o:o + n] for name in COLUMNS}
+        session.update(self.extras(i))
+        return session
+
+    def extras(self, i):
+        """
+        Returns the arrays stored with session `i` besides its columns
+        """
+        o, n = self.index["extras_offset"][i], self.index["extras_size"][i]
+        if n == 0:
+            return {}
+        with np.load(io.BytesIO(self._extras[o:o + n].tobytes())) as data:
+            return {name: data[name] for name in data.files}
+
+    def params(self, i):
+        """
+        Returns the agent parameters stored with session `i`
+        """
+        return json.loads(self.index["params"][i].decode())
+
+def _iter_sources(path):
+    """
+    Yields (member name, timestamp, loader) for every session file in a zip or directory
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if MEMBER_PATTERN.search(info.filename):
+                    raw = archive.read(info)
+                    yield info.filename, time.mktime(info.date_time + (0, 0, -1)), \
+                        lambda raw=raw: np.load(io.BytesIO(raw))
+    else:
+        for directory, _, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(directory, name)
+                if MEMBER_PATTERN.search(file_path):
+                    yield file_path, os.path.getmtime(file_path), lambda p=file_path: np.load(p)
+
+def import_sessions(store, paths):
+    """
+    One-time import of the `data/round_{n}_{label}/{hash}.npz` layout into `store`
+
+    Args:
+      store: the `SessionStore` to import into
+      paths: `.zip` archives (e.g. data.zip, data1.zip) or extracted data directories
+    Returns:
+      the number of imported sessions. Sessions already in the store are skipped, so
+      importing the same archive twice adds nothing
+    """
+    count = 0
+    known = {}
+    for path in paths:
+        for name, timestamp, load in _iter_sources(path):
+            round_num, label, session_id = MEMBER_PATTERN.search(name).groups()
+            label = label or f"Exp{round_num}"
+            if label not in known:
+                known[label] = store.session_ids(label)
+            if session_id in known[label]:
+                continue
+            with load() as data:
+                store.append({key: data[key] for key in data.files}, int(round_num), label,
+                             session_id, params={"source": os.path.basename(path)},
+                             timestamp=timestamp)
+            known[label].add(session_id)
+            count += 1
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar session store")
+    parser.add_argument("--store", default="store", help="store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import zip archives or data directories")
+    import_parser.add_argument("paths", nargs="+")
+    import_parser.add_argument("--float32", action="store_true", help="store columns as float32")
+    commands.add_parser("list", help="list the sessions in the store")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = SessionStore(args.store, np.float32 if args.float32 else np.float64)
+        print(f"Imported {import_sessions(store, args.paths)} sessions into {args.store}")
+    else:
+        store = SessionStore(args.store)
+        for label in store.labels():
+            sessions = store.query(label)
+            print(f"{label}: {len(sessions)} sessions, {int(sessions.index['n_frames'].sum())} frames")
@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cost
+from experiments import AI_Exp1, AI_Exp2, AI_Exp3
+from simulation import BestResponseHuman, simulate_round
+from aggregate import convergence_time, write_table
+
+CACHE_DIRECTORY = ".sweep_cache"
+
+# Parameters of one sweep point, with the values used by `game.run_game`
+DEFAULTS = {
+    "experiment": "Exp3",
+    # agent parameters
+    "alpha": 0.3,
+    "delta": 0.05,
+    "gamma": None,
+    "Delta": 0.05,
+    # gradient estimator of Exp3 and the largest change of L_M per update, see `AI_Exp3`.
+    # None for gamma or max_change takes the estimator's own default from
+    # `experiments.ESTIMATOR_STEPS`, 1.0 and no limit for one_sided
+    "estimator": "one_sided",
+    "max_change": None,
+    "mini_round_frames": 180,
+    "mini_rounds": 10,
+    # synthetic human parameters, see `BestResponseHuman`
+    "noise": 0.01,
+    "lag": 10,
+    "step": 0.1,
+    "max_step": 0.05,
+    # simulation
+    "exp1_frames": 600,
+    "n_sessions": 200,
+    "seed": 0,
+    # relative tolerance used for the convergence time
+    "tolerance": 0.05,
+}
+
+# Parameters that count frames, trials, sessions or seeds. Values given as floats, e.g.
+# "lag=5.0" on the command line or a random sample, are truncated to integers
+INTEGER_PARAMS = ("mini_round_frames", "mini_rounds", "lag", "exp1_frames", "n_sessions", "seed")
+
+# Source files whose contents decide the simulation results. Editing any of them
+# invalidates the cache
+SOURCES = ("cost.py", "experiments.py", "simulation.py", "aggregate.py", "sweep.py")
+
+def grid(**axes):
+    """
+    Returns every combination of the given parameter values
+
+    Example: grid(gamma=[0.5, 1.0], Delta=[0.02, 0.05]) gives 4 points
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+def random_samples(n, seed=0, **ranges):
+    """
+    Returns `n` random parameter points
+
+    Args:
+      n: number of points
+      seed: seed for the random number generator
+      ranges: for each parameter either a (low, high) tuple, sampled uniformly, or a list
+        of values to choose from
+    """
+    rng = np.random.default_rng(seed)
+    points = [{} for _ in range(n)]
+    for name, values in ranges.items():
+        if isinstance(values, tuple):
+            drawn = rng.uniform(values[0], values[1], n)
+        else:
+            drawn = [values[i] for i in rng.integers(0, len(values), n)]
+        for point, value in zip(points, drawn):
+            point[name] = value.item() if isinstance(value, np.generic) else value
+    return points
+
+def _code_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def point_key(point, code_version):
+    """
+    Returns the content address of a sweep point: the hash of its full parameters and of
+    the simulation source code
+    """
+    payload = json.dumps({"point": point, "code": code_version}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def run_point(point):
+    """
+    Simulates one sweep point
+
+    Args:
+      point: dict of parameters, missing parameters take their value from `DEFAULTS`
+    Returns:
+      dict with the parameters and the metrics of the point
+    """
+    p = dict(DEFAULTS, **point)
+    n = p["n_sessions"]
+    human = BestResponseHuman(noise=p["noise"], lag=p["lag"], step=p["step"],
+                              max_step=p["max_step"], seed=p["seed"])
+    trial_frames = p["mini_round_frames"] * p["mini_rounds"] * 2
+    # grid corners such as a large gamma without max_change send L_M off to inf. The
+    # point then reports a NaN final error, one warning per point would only be noise
+    with np.errstate(over="ignore", invalid="ignore"):
+        return _run_point(p, n, human, trial_frames)
+
+def _run_point(p, n, human, trial_frames):
+    if p["experiment"] == "Exp1":
+        agent = AI_Exp1(alpha=p["alpha"], n_sessions=n)
+        results = simulate_round(agent, human, p["exp1_frames"], n, track="m")
+        # Exp1 learns in action space, compare against the Nash action
+        learned, target = results["m"], float(cost.GAME.nash[1])
+    elif p["experiment"] == "Exp2":
+        agent = AI_Exp2(p["mini_round_frames"], delta=p["delta"], n_sessions=n)
+        results = simulate_round(agent, human, trial_frames, n, track="L_M")
+        learned, target = results["L_M"], float(cost.GAME.optimal_policy_slope)
+    elif p["experiment"] == "Exp3":
+        agent = AI_Exp3(p["mini_round_frames"], gamma=p["gamma"], Delta=p["Delta"], n_sessions=n,
+                        estimator=p["estimator"], max_change=p["max_change"], seed=p["seed"])
+        results = simulate_round(agent, human, trial_frames, n, track="L_M")
+        learned, target = results["L_M"], float(cost.GAME.optimal_policy_slope)
+    else:
+        raise ValueError(f"Unknown experiment {p['experiment']}")
+
+    final_error = np.abs(learned[:, -1] - target)
+    times = convergence_time(learned, target, p["tolerance"])
+    convergence_frames = float(np.nanmedian(times)) if np.isfinite(times).any() else float("nan")
+    # spread of the gradient estimates over the sessions next to the spread the agent
+    # reported for them, averaged over the updates
+    gradient_std = reported_gradient_std = float("nan")
+    if p["experiment"] == "Exp3":
+        metadata = agent.metadata()
+        gradient_std = float(np.nanmean(np.nanstd(metadata["estimate_history"][1:], axis=1)))
+        reported_gradient_std = float(np.nanmean(np.sqrt(metadata["variance_history"][1:])))
+    return dict(p,
+                target=target,
+                convergence_frames=convergence_frames,
+                convergence_trials=convergence_frames / p["mini_round_frames"],
+                converged_fraction=float(np.isfinite(times).mean()),
+                final_error_mean=float(final_error.mean()),
+                final_error_median=float(np.median(final_error)),
+                mean_human_cost=float(results["human_scores"].mean()),
+                mean_machine_cost=float(results["machine_scores"].mean()),
+                gradient_std=gradient_std,
+                reported_gradient_std=reported_gradient_std)
+
+def run_sweep(points, cache_directory=CACHE_DIRECTORY, workers=None):
+    """
+    Simulates every point, in parallel on all cores, reusing cached results
+
+    Args:
+      points: list of parameter dicts, see `run_point`
+      cache_directory: directory of the content-addressed result cache
+      workers: number of processes, defaults to the number of cores
+    Returns:
+      list with one row (dict) per point, in the order of `points`
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    code_version = _code_version()
+    full_points = [dict(DEFAULTS, **point) for point in points]
+    for point in full_points:
+        point.update({name: int(point[name]) for name in INTEGER_PARAMS})
+    keys = [point_key(point, code_version) for point in full_points]
+
+    rows = [None] * len(points)
+    missing = []
+    for i, key in enumerate(keys):
+        path = os.path.join(cache_directory, f"{key}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                rows[i] = json.load(f)
+        else:
+            missing.append(i)
+    print(f"{len(points) - len(missing)} points cached, simulating {len(missing)}...")
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, row in zip(missing, pool.map(run_point, [full_points[i] for i in missing])):
+                rows[i] = row
+                # write to a temporary file first, so a cache entry is never half written
+                path = os.path.join(cache_directory, f"{keys[i]}.json")
+                with open(path + ".tmp", "w") as f:
+                    json.dump(row, f)
+                os.replace(path + ".tmp", path)
+    return rows
+
+def _parse_values(text):
+    values = []
+    for item in text.split(","):
+        try:
+            values.append(json.loads(item))
+        except json.JSONDecodeError:
+            values.append(item)
+    return values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep over simulated sessions")
+    parser.add_argument("--grid", nargs="*", default=[], metavar="NAME=V1,V2",
+                        help="grid axis, e.g. gamma=0.5,1,2")
+    parser.add_argument("--random", nargs="*", default=[], metavar="NAME=LOW:HIGH",
+                        help="uniformly sampled parameter, e.g. Delta=0.01:0.1")
+    parser.add_argument("--samples", type=int, default=0, help="number of random samples")
+    parser.add_argument("--set", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="fixed parameter for every point, e.g. experiment=Exp2")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="sweep_results.csv")
+    args = parser.parse_args()
+
+    fixed = {name: _parse_values(value)[0] for name, value in (s.split("=", 1) for s in args.set)}
+    points = grid(**{name: _parse_values(v) for name, v in (g.split("=", 1) for g in args.grid)})
+    if args.samples:
+        ranges = {name: tuple(float(x) for x in r.split(":"))
+                  for name, r in (s.split("=", 1) for s in args.random)}
+        samples = random_samples(args.samples, **ranges)
+        points = [dict(p, **s) for p in points for s in samples]
+    points = [dict(p, **fixed) for p in points]
+
+    rows = run_sweep(points, workers=args.workers)
+    write_table(rows, args.out)
+    print(f"Saved {len(rows)} rows to {args.out}")
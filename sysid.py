@@ -0,0 +1,231 @@
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from aggregate import pad_ragged, write_table
+from loading import SessionLoader, ArchiveLoader
+from store import MEMBER_PATTERN
+
+# Candidate lags in frames, 1 to 30 frames (half a second at 60 Hz). A lag of 0 fits
+# fine, but a synthetic human cannot react to the machine action of its own frame
+DEFAULT_LAGS = tuple(range(1, 31))
+
+# Fewest frame pairs a lag needs to be fitted
+MIN_FRAMES = 10
+
+# Largest weight of the previous human input. At 1 or above a fitted human drifts to
+# the edge of the screen on its own
+MAX_RHO = 0.99
+
+# Fitted parameters of the chosen lag, one table column each
+FIT_COLUMNS = ("a", "rho", "L_H", "r2", "partial_r2", "noise")
+
+# ==========================================
+#          LAGGED LINEAR RESPONSE
+# ==========================================
+
+def _residual(var_y, c11, c22, c12, c1y, c2y, rho, L_H):
+    """
+    Residual sum of squares of h_t = a + rho * h_{t-1} + L_H * m_{t-lag} from the
+    centered sums, with the intercept at its optimum for the given rho and L_H
+    """
+    return np.maximum(var_y - 2 * rho * c1y - 2 * L_H * c2y + rho * rho * c11
+                      + 2 * rho * L_H * c12 + L_H * L_H * c22, 0.0)
+
+def fit_lag(h, m, lag):
+    """
+    Least squares fit of h_t = a + rho * h_{t-1} + L_H * m_{t-lag} for every session at
+    once, with |rho| at most `MAX_RHO` so the fitted human is stable
+
+    Args:
+      h, m: NaN padded arrays of shape (n_sessions, n_frames), see `aggregate.pad_ragged`
+      lag: delay in frames between a machine action and the human input it explains
+    Returns:
+      dict of arrays of shape (n_sessions,): the intercept "a", the persistence "rho" of
+      the human input, the slope "L_H", the coefficient of determination "r2", the
+      partial coefficient of determination of the m term "partial_r2", the residual
+      standard deviation "noise" and the number of frame triples "frames". NaN where a
+      session has fewer than `MIN_FRAMES` triples or h_{t-1} and m_{t-lag} do not vary
+      independently
+    """
+    start = max(lag, 1)
+    y = h[:, start:]
+    x1 = h[:, start - 1:h.shape[1] - 1]
+    x2 = m[:, start - lag:m.shape[1] - lag]
+    valid = ~(np.isnan(x1) | np.isnan(x2) | np.isnan(y))
+    x1 = np.where(valid, x1, 0.0)
+    x2 = np.where(valid, x2, 0.0)
+    y = np.where(valid, y, 0.0)
+
+    # the centered normal equations of every session from its sums, one pass over the stack
+    n = np.sum(valid, axis=1)
+    s1, s2, sy = np.sum(x1, axis=1), np.sum(x2, axis=1), np.sum(y, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        c11 = np.sum(x1 * x1, axis=1) - s1 * s1 / n
+        c22 = np.sum(x2 * x2, axis=1) - s2 * s2 / n
+        c12 = np.sum(x1 * x2, axis=1) - s1 * s2 / n
+        c1y = np.sum(x1 * y, axis=1) - s1 * sy / n
+        c2y = np.sum(x2 * y, axis=1) - s2 * sy / n
+        var_y = np.sum(y * y, axis=1) - sy * sy / n
+        det = c11 * c22 - c12 * c12
+        # a machine playing m = L_M * h + c makes m_{t-1} a copy of h_{t-1}
+        usable = (n >= MIN_FRAMES) & (c11 > 1e-12 * n) & (c22 > 1e-12 * n) & (det > 1e-6 * c11 * c22)
+        rho = (c22 * c1y - c12 * c2y) / det
+        L_H = (c11 * c2y - c12 * c1y) / det
+        # the loss is convex, so past the bound the constrained optimum is on it
+        clipped = np.abs(rho) > MAX_RHO
+        rho = np.where(clipped, np.clip(rho, -MAX_RHO, MAX_RHO), rho)
+        L_H = np.where(clipped, (c2y - rho * c12) / c22, L_H)
+        a = (sy - rho * s1 - L_H * s2) / n
+        ss_res = _residual(var_y, c11, c22, c12, c1y, c2y, rho, L_H)
+        # the same model without the m term, what m_{t-lag} adds is the lag's evidence
+        rho_ar = np.clip(c1y / c11, -MAX_RHO, MAX_RHO)
+        ss_ar = _residual(var_y, c11, c22, c12, c1y, c2y, rho_ar, 0.0)
+        r2 = np.where(var_y > 0, 1.0 - ss_res / var_y, np.nan)
+        partial_r2 = np.where(ss_ar > 0, 1.0 - ss_res / ss_ar, np.nan)
+        noise = np.sqrt(ss_res / (n - 3))
+    fitted = lambda x: np.where(usable, x, np.nan)
+    return {"a": fitted(a), "rho": fitted(rho), "L_H": fitted(L_H), "r2": fitted(r2),
+            "partial_r2": fitted(partial_r2), "noise": fitted(noise), "frames": n}
+
+def fit_sessions(human_inputs, machine_inputs, lags=DEFAULT_LAGS):
+    """
+    Fits the lagged linear response h_t = a + rho * h_{t-1} + L_H * m_{t-k} + noise to
+    every session, keeping the lag k whose m term explains the most.
+
+    All sessions are stacked into one NaN padded array and fitted together, one
+    vectorized least squares per candidate lag.
+
+    This is not the static response h_t = a + L_H * m_{t-k} first asked for. The machine
+    reacts to h as well, so in a closed loop session m_{t-k} follows the slowly moving h,
+    and the static fit picks lag 1 with L_H near 1 / L_M, the machine's own policy
+    inverted. Here rho takes up the persistence of the human input, bounded by `MAX_RHO`
+    so a fitted human never drifts off on its own, and L_H is what m adds to it. With
+    h_{t-1} in the model R^2 is close to 1 at every lag, so the lag is chosen by the
+    partial R^2 of the m term instead. It is still not a causal estimate, the human's
+    reaction and the machine's policy are only told apart by their lag.
+
+    Args:
+      human_inputs, machine_inputs: lists of 1D arrays, one per session
+      lags: candidate lags in frames
+    Returns:
+      dict of arrays of shape (n_sessions,): the best "lag", its "a", "rho", "L_H",
+      "r2", "partial_r2", "noise" and "frames", and "partial_r2_by_lag" of shape
+      (len(lags), n_sessions)
+    """
+    h = pad_ragged(human_inputs)
+    m = pad_ragged(machine_inputs, length=h.shape[1])
+    lags = np.asarray(lags, dtype=np.int64)
+    fits = [fit_lag(h, m, lag) for lag in lags]
+    by_lag = np.array([fit["partial_r2"] for fit in fits]).reshape(len(lags), len(h))
+
+    fitted = ~np.all(np.isnan(by_lag), axis=0)
+    best = np.argmax(np.where(np.isnan(by_lag), -np.inf, by_lag), axis=0)
+    sessions = np.arange(len(h))
+    result = {"lag": np.where(fitted, lags[best], -1)}
+    for name in FIT_COLUMNS:
+        values = np.array([fit[name] for fit in fits], dtype=np.float64).reshape(len(lags), len(h))
+        result[name] = np.where(fitted, values[best, sessions], np.nan)
+    result["frames"] = np.array([len(x) for x in human_inputs], dtype=np.int64)
+    result["partial_r2_by_lag"] = by_lag
+    return result
+
+def _fit_chunk(human_inputs, machine_inputs, lags):
+    """
+    Fits a chunk of sessions. Runs in a worker process
+    """
+    result = fit_sessions(human_inputs, machine_inputs, lags)
+    del result["partial_r2_by_lag"]
+    return result
+
+def _session_id(source):
+    match = MEMBER_PATTERN.search(source)
+    return match.group(3) if match else source
+
+def fit_table(loader, experiments=(1, 2, 3), lags=DEFAULT_LAGS, workers=1, chunk_size=500):
+    """
+    Fits every recorded session of the given experiments.
+
+    Sessions are loaded by `loader` in chunks of `chunk_size`. With `workers` above 1 the
+    chunks are fitted in a process pool, the next chunk is only loaded once fewer than
+    `workers` are waiting to be fitted. Sessions carry no participant id, so every row
+    is one participant in one round, named by the session hash.
+
+    Args:
+      loader: a `SessionLoader` or `ArchiveLoader`
+      experiments: experiment numbers
+      lags: candidate lags in frames
+      workers: number of processes, 1 fits in this process
+      chunk_size: number of sessions fitted together
+    Returns:
+      list of table rows (dicts) with the experiment, session, frames, lag, a, rho, L_H,
+      r2, partial_r2 and noise of each session, sessions that could not be fitted are left out
+    """
+    lags = tuple(int(lag) for lag in lags)
+    rows = []
+    for round_num in experiments:
+        files = loader.files(round_num, f"Exp{round_num}")
+        if not files:
+            print(f"  No data found for Round {round_num}.")
+            continue
+        chunks = loader.iter_load(files, keys=("human_inputs", "machine_inputs"), chunk_size=chunk_size)
+        args = (([s["human_inputs"] for s in chunk], [s["machine_inputs"] for s in chunk], lags)
+                for chunk in chunks)
+        if workers == 1:
+            results = [_fit_chunk(*a) for a in args]
+        else:
+            # submit one chunk at a time, at most `workers` are loaded and not yet fitted
+            results = []
+            pending = collections.deque()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for a in args:
+                    if len(pending) >= workers:
+                        results.append(pending.popleft().result())
+                    pending.append(pool.submit(_fit_chunk, *a))
+                results.extend(future.result() for future in pending)
+
+        fit = {name: np.concatenate([r[name] for r in results]) for name in results[0]}
+        for i, source in enumerate(files):
+            if fit["lag"][i] < 0:
+                continue
+            rows.append({"experiment": f"Exp{round_num}", "session": _session_id(source),
+                         "frames": int(fit["frames"][i]), "lag": int(fit["lag"][i]),
+                         **{name: float(fit[name][i]) for name in FIT_COLUMNS}})
+    return rows
+
+def _parse_lags(text):
+    """
+    Parses "1:30" (inclusive) or "1,5,10"
+    """
+    if ":" in text:
+        low, high = (int(x) for x in text.split(":"))
+        return tuple(range(low, high + 1))
+    return tuple(int(x) for x in text.split(","))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fit the lagged linear response h_t = a + rho * h_(t-1) + L_H * m_(t-k) "
+                    "of every recorded session")
+    parser.add_argument("--data-root", default="data", help="directory holding the round_* folders")
+    parser.add_argument("--archives", nargs="*", default=None, metavar="ZIP",
+                        help="read the sessions straight from zip archives, e.g. data.zip data1.zip")
+    parser.add_argument("--experiments", nargs="*", type=int, default=[1, 2, 3], choices=[1, 2, 3])
+    parser.add_argument("--lags", default="1:30", help="candidate lags in frames, e.g. 1:30 or 1,5,10")
+    parser.add_argument("--workers", type=int, default=1, help="number of fitting processes")
+    parser.add_argument("--out", default="sysid_results.csv")
+    args = parser.parse_args()
+
+    if args.archives:
+        loader = ArchiveLoader(args.archives, cache_directory=None)
+    else:
+        loader = SessionLoader(args.data_root, cache_directory=None)
+    rows = fit_table(loader, args.experiments, _parse_lags(args.lags), args.workers)
+    for label in sorted({row["experiment"] for row in rows}):
+        group = [row for row in rows if row["experiment"] == label]
+        median = {name: np.median([row[name] for row in group]) for name in ("lag", "rho", "L_H", "partial_r2")}
+        print(f"[{label}] {len(group)} sessions | median lag {median['lag']:.0f} frames | "
+              f"median rho {median['rho']:.3f} | median L_H {median['L_H']:.3f} | "
+              f"median partial R^2 {median['partial_r2']:.3f}")
+    if rows:
+        write_table(rows, args.out)
+        print(f"Saved {len(rows)} rows to {args.out}")
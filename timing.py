@@ -0,0 +1,112 @@
+import time
+import numpy as np
+
+# Parts of the `run_round` frame loop, in the order they run
+SECTIONS = ("input", "agent", "cost", "database", "draw", "events", "display")
+
+class FrameTimer:
+    """
+    Records how long every frame, and every part of a frame, actually took.
+
+    All timings go into a ring buffer allocated up front, so recording a frame only
+    costs a few `time.perf_counter` calls and never allocates. Usage in the frame loop:
+
+      timer.start_frame()
+      h = get_input()
+      timer.mark("input")
+      ...
+    """
+    def __init__(self, capacity, fps=60, sections=SECTIONS):
+        """
+        Args:
+          capacity: number of frames kept, older frames are overwritten
+          fps: target frame rate, used to count dropped frames
+          sections: names of the timed parts of a frame
+        """
+        self.capacity = capacity
+        self.fps = fps
+        self.sections = tuple(sections)
+        self._columns = {name: i for i, name in enumerate(self.sections)}
+        self.frame_starts = np.zeros(capacity, dtype=np.float64)
+        self.section_times = np.zeros((capacity, len(self.sections)), dtype=np.float64)
+        self.n_frames = 0
+        self._row = -1
+        self._last = 0.0
+
+    def start_frame(self):
+        """
+        Marks the start of a new frame
+        """
+        now = time.perf_counter()
+        self._row = self.n_frames % self.capacity
+        self.frame_starts[self._row] = now
+        self.section_times[self._row] = 0.0
+        self.n_frames += 1
+        self._last = now
+
+    def mark(self, section):
+        """
+        Records the time since the last mark (or the frame start) for `section`
+        """
+        now = time.perf_counter()
+        self.section_times[self._row, self._columns[section]] += now - self._last
+        self._last = now
+
+    def _ordered(self, values):
+        """
+        Returns the rows of the ring buffer oldest first
+        """
+        if self.n_frames <= self.capacity:
+            return values[:self.n_frames]
+        return np.roll(values, -(self.n_frames % self.capacity), axis=0)
+
+    def arrays(self):
+        """
+        Returns the recorded timings as arrays, ready to be saved with the session data
+
+        Returns:
+          dict with `frame_timestamps` (seconds, `time.perf_counter` clock) and one
+          `time_{section}` array in seconds for every section
+        """
+        arrays = {"frame_timestamps": self._ordered(self.frame_starts).copy()}
+        section_times = self._ordered(self.section_times)
+        for name, i in self._columns.items():
+            arrays[f"time_{name}"] = section_times[:, i].copy()
+        return arrays
+
+    def summary(self):
+        """
+        Returns frame time statistics in milliseconds
+
+        Returns:
+          dict with the p50/p99 frame time, the jitter (standard deviation of the frame
+          time), the number of dropped frames (target frames missed by the long frames) and
+          the mean time of every section
+        """
+        starts = self._ordered(self.frame_starts)
+        frame_times = np.diff(starts) * 1000.0
+        if len(frame_times) == 0:
+            frame_times = np.zeros(1)
+        target = 1000.0 / self.fps
+        result = {
+            "frames": self.n_frames,
+            "p50_ms": float(np.percentile(frame_times, 50)),
+            "p99_ms": float(np.percentile(frame_times, 99)),
+            "jitter_ms": float(np.std(frame_times)),
+            # a frame lasting k target frames stands in for k - 1 frames never drawn
+            "dropped_frames": int(np.sum(np.maximum(np.round(frame_times / target) - 1, 0))),
+        }
+        section_times = self._ordered(self.section_times)
+        for name, i in self._columns.items():
+            result[f"{name}_ms"] = float(section_times[:, i].mean() * 1000.0) if len(section_times) else 0.0
+        return result
+
+    def print_summary(self, label=""):
+        """
+        Prints the end of round summary
+        """
+        s = self.summary()
+        sections = " | ".join(f"{name} {s[f'{name}_ms']:.3f}" for name in self.sections)
+        print(f"  -> [{label}] frame time p50 {s['p50_ms']:.2f} ms, p99 {s['p99_ms']:.2f} ms, "
+              f"jitter {s['jitter_ms']:.2f} ms, dropped {s['dropped_frames']}/{s['frames']} frames")
+        print(f"     mean per frame (ms): {sections}")
@@ -1,8 +1,9 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import glob
-import os
+import argparse
 import cost  # Imports your cost parameters for theoretical lines
+from loading import SessionLoader, ArchiveLoader
+from aggregate import learning_curves, action_density
+from bootstrap import bootstrap_mean_curves
 
 # ==========================================
 #        THEORETICAL REFERENCE LINES
@@ -14,23 +15,37 @@ def get_reaction_curves():
     
     # Human Best Response: d(cH)/dh = 0
     # Formula: h = hH - (BH/AH)*(m - mH)
-    h_best_response = cost.hH - (cost.BH / cost.AH) * (m_vals - cost.mH)
+    h_best_response = cost.GAME.human_best_response(m_vals)
     
     # Machine Best Response: d(cM)/dm = 0
     # Formula: m = mM - (BM/AM)*(h - hM)
-    m_best_response = cost.mM - (cost.BM / cost.AM) * (h_vals - cost.hM)
+    m_best_response = cost.GAME.machine_best_response(h_vals)
     
     return m_vals, h_best_response, h_vals, m_best_response
 
 # ==========================================
 #              PLOTTING LOGIC
 # ==========================================
-def plot_experiment_1():
+def plot_experiment_1(loader=None, render="auto"):
+    """
+    Plots the (h, m) trajectories of Experiment 1 over the best response lines
+
+    Args:
+      render: "lines" draws every trajectory and final point, "density" a 2D histogram
+        of all trajectory points with the density of the final points on top, "auto"
+        switches to "density" above `MAX_LINE_SESSIONS` sessions
+    """
+    # imported here, matplotlib is slow to import and only needed for plotting
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
     print("Visualizing Experiment 1 (Nash Equilibrium)...")
-    files = glob.glob("data/round_1_Exp1/*.npz")
+    loader = loader or SessionLoader()
+    files = loader.files(1, "Exp1")
     if not files:
         print("  No data found for Round 1.")
         return
+    if render == "auto":
+        render = "density" if len(files) > MAX_LINE_SESSIONS else "lines"
 
     plt.figure(figsize=(10, 8))
     
@@ -39,19 +54,23 @@ def plot_experiment_1():
     plt.plot(h_br, m_axis, 'g--', label="Human Best Response", alpha=0.6)
     plt.plot(h_axis, m_br, 'r--', label="Machine Best Response", alpha=0.6)
     
-    # Calculate Nash (Intersection) roughly for plotting
-    # Nash is where the lines cross. 
-    plt.scatter([-0.2], [-0.2], color='black', s=100, zorder=10, label="Nash Equilibrium")
+    # Nash is where the lines cross, solved in closed form by the game model
+    nash_h, nash_m = cost.GAME.nash
+    plt.scatter([nash_h], [nash_m], color='black', s=100, zorder=10, label="Nash Equilibrium")
 
     # 2. Plot Real Data Trajectories
-    for i, f in enumerate(files):
-        data = np.load(f)
-        h = data['human_inputs']
-        m = data['machine_inputs']
-        # Plot trajectory with transparency to see density
-        plt.plot(h, m, color='blue', alpha=0.15)
+    if render == "density":
+        density = loader.summary("density", files, action_density, keys=("human_inputs", "machine_inputs"),
+                                 bins=DENSITY_BINS)
+        _draw_density(plt.gca(), density)
+    else:
+        sessions = loader.load(files, keys=("human_inputs", "machine_inputs"))
+        # one collection for all trajectories, with transparency to see density
+        lines = [np.column_stack((data['human_inputs'], data['machine_inputs'])) for data in sessions]
+        plt.gca().add_collection(LineCollection(lines, colors='blue', alpha=0.15))
         # Plot final point of each run
-        plt.scatter(h[-1], m[-1], color='blue', s=10, alpha=0.5)
+        final = np.array([line[-1] for line in lines if len(line)]).reshape(-1, 2)
+        plt.scatter(final[:, 0], final[:, 1], color='blue', s=10, alpha=0.5)
 
     plt.title("Experiment 1: Convergence to Nash Equilibrium")
     plt.xlabel("Human Action (h)")
@@ -63,49 +82,135 @@ def plot_experiment_1():
     plt.savefig("results_exp1.png")
     print("  -> Saved results_exp1.png")
 
-def plot_learning_experiments(round_num, title, filename):
+def plot_action_density(round_num, title, filename, loader=None):
+    """
+    Plots the density of the (h, m) points of all sessions of Experiment 2 or 3 over the
+    best response lines and the optimal machine policy
+    """
+    import matplotlib.pyplot as plt
+    print(f"Visualizing {title} actions...")
+    loader = loader or SessionLoader()
+    files = loader.files(round_num, f"Exp{round_num}")
+    if not files:
+        print(f"  No data found for Round {round_num}.")
+        return
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    density = loader.summary("density", files, action_density, keys=("human_inputs", "machine_inputs"),
+                             bins=DENSITY_BINS)
+    _draw_density(ax, density)
+
+    m_axis, h_br, h_axis, m_br = get_reaction_curves()
+    ax.plot(h_br, m_axis, 'g--', label="Human Best Response", alpha=0.6)
+    ax.plot(h_axis, m_br, 'r--', label="Machine Best Response", alpha=0.6)
+    # the policy the agents should learn, through the machine's optimum
+    L = cost.GAME.optimal_policy_slope
+    ax.plot(h_axis, L * (h_axis - cost.hM) + cost.mM, 'k:', label=f"Optimal Policy (L = {L:.3f})", alpha=0.8)
+    ax.scatter([cost.hM], [cost.mM], color='black', marker='*', s=150, zorder=10, label="Machine Optimum")
+    nash_h, nash_m = cost.GAME.nash
+    ax.scatter([nash_h], [nash_m], color='black', s=100, zorder=10, label="Nash Equilibrium")
+
+    ax.set_title(f"{title}: Actions of {int(density['sessions'])} Sessions")
+    ax.set_xlabel("Human Action (h)")
+    ax.set_ylabel("Machine Action (m)")
+    ax.set_xlim(-1, 1)
+    ax.set_ylim(-1, 1)
+    ax.legend(loc='best')
+    ax.grid(True, alpha=0.3)
+    fig.savefig(filename)
+    print(f"  -> Saved {filename}")
+
+def _draw_density(ax, density, mass=(0.9, 0.5)):
+    """
+    Draws the trajectory histogram of `action_density` as one log scaled image and the
+    regions holding `mass` of the final points as contours on top
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    from matplotlib.lines import Line2D
+    low, high = density["extent"]
+    counts = density["counts"]
+    if counts.any():
+        # rows of an image are m, the histogram is indexed [h, m]
+        image = ax.imshow(np.ma.masked_equal(counts.T, 0), origin='lower', extent=(low, high, low, high),
+                          cmap='Blues', norm=LogNorm(vmin=1, vmax=counts.max()), aspect='auto',
+                          interpolation='nearest')
+        plt.colorbar(image, ax=ax, label="Frames per bin")
+
+    endpoints = density["endpoints"]
+    levels = _mass_levels(endpoints, mass)
+    if len(levels):
+        centers = low + (np.arange(len(endpoints)) + 0.5) * (high - low) / len(endpoints)
+        ax.contour(centers, centers, endpoints.T, levels=levels, colors='darkorange', linewidths=1.5)
+        ax.add_line(Line2D([], [], color='darkorange',
+                           label=f"Final Points ({', '.join(f'{q:.0%}' for q in mass)} of sessions)"))
+
+def _mass_levels(counts, mass):
+    """
+    Returns the increasing count thresholds whose bins above hold `mass` of all counts
+    """
+    values = np.sort(counts.ravel())[::-1]
+    total = values.sum()
+    if total == 0:
+        return np.array([])
+    cumulative = np.cumsum(values) / total
+    levels = [values[min(np.searchsorted(cumulative, q), len(values) - 1)] for q in mass]
+    # contour draws the boundary between bins below and at or above a level
+    return np.unique([level - 0.5 for level in levels if level > 0])
+
+# Above this many sessions `plot_experiment_1` draws a density image instead of lines
+MAX_LINE_SESSIONS = 200
+# Bins per axis of the (h, m) density images
+DENSITY_BINS = 256
+# Above this many sessions the learning curves use bounded-memory streaming quantiles
+MAX_EXACT_SESSIONS = 5000
+# Histogram ranges of the streaming quantiles. Human cost is in [0, 596 / 375], the
+# machine cost is at most 2.5 while both actions stay in [-1, 1]
+STREAMING_RANGES = {"machine_scores": (0.0, 2.5), "human_scores": (0.0, 596 / 375)}
+
+def _learning_summary(chunks, window, streaming):
+    """
+    Median and p10-p90 band of machine and human cost over all sessions, smoothed with a
+    moving average. Computed through `SessionLoader.summary`, so it is cached between runs.
+    """
+    curves = learning_curves(chunks, ("machine_scores", "human_scores"), window=window,
+                             streaming=STREAMING_RANGES if streaming else None)
+    # flatten for the cache, e.g. "machine_scores_q50"
+    return {f"{key}_{name}": values for key, curve in curves.items() for name, values in curve.items()}
+
+def _bootstrap_summary(chunks, window, n_resamples):
+    """
+    Mean machine and human cost with bootstrap confidence bands, see `bootstrap_mean_curves`
+    """
+    return bootstrap_mean_curves(chunks, ("machine_scores", "human_scores"), n_resamples, window=window)
+
+def plot_learning_experiments(round_num, title, filename, loader=None, bootstrap=0):
+    """
+    Plots the median machine and human cost over time with p10-p90 bands
+
+    Args:
+      bootstrap: number of bootstrap resamples for a 95% confidence band of the mean cost
+        curves, 0 to leave the bands out
+    """
+    import matplotlib.pyplot as plt
     print(f"Visualizing {title}...")
-    # for tyler: Change path as needed (data1 to data)
-    files = glob.glob(f"data1/round_{round_num}_Exp{round_num}/*.npz")
+    loader = loader or SessionLoader()
+    files = loader.files(round_num, f"Exp{round_num}")
     if not files:
         print(f"  No data found for Round {round_num}.")
         return
 
     fig, ax = plt.subplots(figsize=(12, 6))
-    
-    all_costs = []
-    all_human_costs = []
-    min_len = float('inf')
-
-    # 1. Load all files
-    for f in files:
-        data = np.load(f)
-        # We care about Machine Cost (optimizing its objective)
-        c_m = data['machine_scores']
-        c_h = data['human_scores']
-        all_costs.append(c_m)
-        all_human_costs.append(c_h)
-        if len(c_m) < min_len:
-            min_len = len(c_m)
-        if len(c_h) < min_len:
-            min_len = len(c_h)
-
-    # 2. Trim to shortest length to average them
-    trimmed_costs = [c[:min_len] for c in all_costs]
-    trimmed_human = [c[:min_len] for c in all_human_costs]
-    avg_cost = np.median(trimmed_costs, axis=0)
-    avg_human = np.median(trimmed_human, axis=0)
-    
-    # 3. Apply Moving Average to smooth the noise
+
+    # 1-3. Load all sessions, take the median and p10-p90 band without trimming them to
+    # the shortest session, and smooth (cached between runs)
     window = 100
-    if min_len > window:
-        smooth_avg = np.convolve(avg_cost, np.ones(window)/window, mode='valid')
-        smooth_human = np.convolve(avg_human, np.ones(window)/window, mode='valid')
-        time_axis = np.arange(len(smooth_avg))
-    else:
-        smooth_avg = avg_cost
-        smooth_human = avg_human
-        time_axis = np.arange(len(smooth_avg))
+    summary = loader.summary("learning", files, _learning_summary,
+                             keys=("machine_scores", "human_scores"), window=window,
+                             streaming=len(files) > MAX_EXACT_SESSIONS)
+    smooth_avg = summary["machine_scores_q50"]
+    smooth_human = summary["human_scores_q50"]
+    time_axis = np.arange(len(smooth_avg))
 
     # 4. Plot individual runs (lightly) and average (bold)
     # for c in trimmed_costs:
@@ -113,7 +218,15 @@ def plot_learning_experiments(round_num, title, filename):
     #     ax.plot(c, color='gray', alpha=0.05)
 
     # Machine cost on primary y-axis
+    ax.fill_between(time_axis, summary["machine_scores_q10"], summary["machine_scores_q90"],
+                    color='red', alpha=0.15, linewidth=0, label="Machine Cost p10-p90")
     ax.plot(time_axis, smooth_avg, color='red', linewidth=2, label="Average Machine Cost")
+    if bootstrap:
+        bands = loader.summary("bootstrap", files, _bootstrap_summary,
+                               keys=("machine_scores", "human_scores"), window=window, n_resamples=bootstrap)
+        ax.fill_between(time_axis, bands["machine_scores_low"], bands["machine_scores_high"],
+                        color='darkred', alpha=0.35, linewidth=0, label="Mean Machine Cost 95% CI")
+        ax.plot(time_axis, bands["machine_scores_mean"], color='darkred', linestyle='--', label="Mean Machine Cost")
     ax.set_title(f"{title}: Cost Reduction Over Time")
     ax.set_xlabel("Time (Frames)")
     ax.set_ylabel("Machine Cost ($c_M$)", color='red')
@@ -121,7 +234,13 @@ def plot_learning_experiments(round_num, title, filename):
 
     # Human cost on secondary y-axis
     ax2 = ax.twinx()
+    ax2.fill_between(time_axis, summary["human_scores_q10"], summary["human_scores_q90"],
+                     color='blue', alpha=0.15, linewidth=0, label="Human Cost p10-p90")
     ax2.plot(time_axis, smooth_human, color='blue', linewidth=2, label="Average Human Cost")
+    if bootstrap:
+        ax2.fill_between(time_axis, bands["human_scores_low"], bands["human_scores_high"],
+                         color='darkblue', alpha=0.35, linewidth=0, label="Mean Human Cost 95% CI")
+        ax2.plot(time_axis, bands["human_scores_mean"], color='darkblue', linestyle='--', label="Mean Human Cost")
     ax2.set_ylabel("Human Cost ($c_H$)", color='blue')
     ax2.tick_params(axis='y', colors='blue')
 
@@ -136,8 +255,36 @@ def plot_learning_experiments(round_num, title, filename):
     print(f"  -> Saved {filename}")
 
 if __name__ == "__main__":
-    plot_experiment_1()
-    plot_learning_experiments(1, "Experiment 1 (Nash Equilibrium)", "results_exp1_learning.png")   
-    plot_learning_experiments(2, "Experiment 2 (Conjectural Variations)", "results_exp2.png")
-    plot_learning_experiments(3, "Experiment 3 (Policy Gradient)", "results_exp3.png")
+    parser = argparse.ArgumentParser(description="Plot the results of the experiments")
+    parser.add_argument("--data-root", default="data", help="directory holding the round_* folders")
+    parser.add_argument("--archives", nargs="*", default=None, metavar="ZIP",
+                        help="read the sessions straight from zip archives, e.g. data.zip data1.zip")
+    parser.add_argument("--experiments", nargs="*", type=int, default=[1, 2, 3],
+                        choices=[1, 2, 3], help="experiments to plot")
+    parser.add_argument("--workers", type=int, default=None, help="number of loader threads")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the summary cache")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="draw 95%% confidence bands of the mean costs from N bootstrap resamples")
+    parser.add_argument("--render", default="auto", choices=["auto", "lines", "density"],
+                        help="draw the Experiment 1 trajectories as lines or as a density image, "
+                             f"auto uses density above {MAX_LINE_SESSIONS} sessions")
+    args = parser.parse_args()
+
+    cache_directory = None if args.no_cache else ".viz_cache"
+    if args.archives:
+        loader = ArchiveLoader(args.archives, cache_directory=cache_directory, workers=args.workers)
+    else:
+        loader = SessionLoader(args.data_root, cache_directory=cache_directory, workers=args.workers)
+    if 1 in args.experiments:
+        plot_experiment_1(loader, render=args.render)
+        plot_learning_experiments(1, "Experiment 1 (Nash Equilibrium)", "results_exp1_learning.png", loader,
+                                  bootstrap=args.bootstrap)
+    if 2 in args.experiments:
+        plot_learning_experiments(2, "Experiment 2 (Conjectural Variations)", "results_exp2.png", loader,
+                                  bootstrap=args.bootstrap)
+        plot_action_density(2, "Experiment 2 (Conjectural Variations)", "results_exp2_actions.png", loader)
+    if 3 in args.experiments:
+        plot_learning_experiments(3, "Experiment 3 (Policy Gradient)", "results_exp3.png", loader,
+                                  bootstrap=args.bootstrap)
+        plot_action_density(3, "Experiment 3 (Policy Gradient)", "results_exp3_actions.png", loader)
     print("Done!")
\ No newline at end of file